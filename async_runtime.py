@@ -0,0 +1,60 @@
+"""A long-lived asyncio event loop shared by every session in the process.
+
+Streamlit runs each script on its own thread, and `asyncio.run` per message would
+build and tear down a loop every turn, taking async HTTP clients bound to the old
+loop down with it. Async iterables are consumed on this loop instead, and their
+streamed chunks are handed back to the calling script thread.
+"""
+import asyncio
+import queue
+import threading
+
+_loop = None
+_lock = threading.Lock()
+_DONE = object()
+
+
+def get_loop():
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-runtime", daemon=True).start()
+        return _loop
+
+
+def iterate(async_iterable, timeout=None):
+    """Consumes an async iterable on the shared loop, yielding its items in the calling thread.
+
+    Items are passed through a queue, so the caller can safely touch Streamlit
+    elements between items. If the caller stops early (for example the script is
+    interrupted by a rerun), the producer is cancelled.
+    """
+    items = queue.Queue()
+
+    async def pump():
+        error = None
+        try:
+            async for item in async_iterable:
+                items.put((item, None))
+        except asyncio.CancelledError as cancelled:
+            error = cancelled
+            raise
+        except BaseException as caught:
+            # Handed to the caller instead of being raised on the shared loop
+            error = caught
+        finally:
+            # Always wake the caller, so it never waits on the queue for a producer that has stopped
+            items.put((_DONE, error))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    try:
+        while True:
+            item, error = items.get(timeout=timeout)
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        future.cancel()
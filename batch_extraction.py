@@ -0,0 +1,283 @@
+"""Headless document extraction for bulk applicant onboarding.
+
+Takes applicant packets from a directory (one subdirectory per applicant, with
+files named after the document type: ID.jpg, DTI.png, ITR.jpeg, Bank_Statement.jpg)
+or a JSONL manifest, one packet per line:
+
+    {"applicant": "A-0001", "documents": {"ID": "scans/a1/id.jpg", "ITR": "scans/a1/itr.jpg"}}
+
+Every document goes through the same extraction as the eligibility form (and
+shares its cache), on a worker pool that paces GPT-4o calls to a requests-per-minute
+budget and backs off for everyone when OpenAI rate-limits. One prefilled profile
+per applicant is appended to the output as soon as its packet is done:
+
+    python batch_extraction.py packets/ --output profiles.jsonl
+    python batch_extraction.py manifest.jsonl --output profiles.jsonl --workers 8 --requests-per-minute 300
+
+The output is also the checkpoint. Running the same command after an interruption
+skips applicants already in it; --retry-failed also redoes those with errors
+(when an applicant appears more than once, the last line is the current one).
+From Python:
+
+    from batch_extraction import load_packets, run_batch
+    summary = run_batch(load_packets("packets/"), "profiles.jsonl")
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+
+import tracing
+from http_clients import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_TYPES = ("ID", "DTI", "ITR", "Bank_Statement")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+# GPT-4o vision requests per minute the batch may use; keep some of the account's limit for live users
+BATCH_REQUESTS_PER_MINUTE = float(os.getenv("BATCH_REQUESTS_PER_MINUTE", "300"))
+# How often one document is retried after being rate limited, and the pause when OpenAI doesn't say how long
+RATE_LIMIT_RETRIES = 5
+RATE_LIMIT_PAUSE_SECONDS = 30.0
+PROGRESS_EVERY = 25
+
+
+class RateLimiter:
+    """Spaces calls out to `per_minute`, and holds every caller back after a rate-limit response."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_call = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_call)
+            self._next_call = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._next_call = max(self._next_call, time.monotonic() + seconds)
+
+
+def document_type_for(filename):
+    stem, extension = os.path.splitext(os.path.basename(filename))
+    if extension.lower() not in IMAGE_EXTENSIONS:
+        return None
+    normalized = stem.lower().replace("-", "_").replace(" ", "_")
+    return next((document_type for document_type in DOCUMENT_TYPES if document_type.lower() == normalized), None)
+
+
+def load_packets(source):
+    """Applicant packets from a directory of per-applicant folders or a JSONL manifest.
+
+    Each packet is a dict with "applicant" and "documents" ({document type: image path})
+    and optionally "has_middle_name" ({document type: bool}; by default only the ID has one).
+    """
+    if os.path.isdir(source):
+        packets = []
+        for applicant in sorted(os.listdir(source)):
+            folder = os.path.join(source, applicant)
+            if not os.path.isdir(folder):
+                continue
+            documents = {}
+            for filename in sorted(os.listdir(folder)):
+                document_type = document_type_for(filename)
+                if document_type is None:
+                    logger.warning("Skipping %s: not named after a document type", os.path.join(folder, filename))
+                elif document_type in documents:
+                    logger.warning("Skipping %s: %s already has a %s", filename, applicant, document_type)
+                else:
+                    documents[document_type] = os.path.join(folder, filename)
+            packets.append({"applicant": applicant, "documents": documents})
+        return packets
+
+    base = os.path.dirname(os.path.abspath(source))
+    packets = []
+    with open(source, encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            packet = json.loads(line)
+            unknown = set(packet["documents"]) - set(DOCUMENT_TYPES)
+            if unknown:
+                raise ValueError(f"{packet['applicant']}: unknown document types {sorted(unknown)}")
+            packet["documents"] = {
+                document_type: os.path.join(base, path) for document_type, path in packet["documents"].items()
+            }
+            packets.append(packet)
+    return packets
+
+
+def read_checkpoint(output_path):
+    """The latest output line per applicant already in output_path."""
+    done = {}
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # The line being written when the last run was killed
+                logger.warning("Ignoring an incomplete line in %s", output_path)
+                continue
+            done[result["applicant"]] = result
+    return done
+
+
+def merge_profile(documents):
+    """One profile from every document's fields, merged in the order the eligibility form uses."""
+    profile = {}
+    for document_type in DOCUMENT_TYPES:
+        profile.update(documents.get(document_type) or {})
+    return profile
+
+
+class BatchRun:
+    def __init__(self, output, max_workers, requests_per_minute):
+        from extraction import extract_fields
+
+        self.extract_fields = extract_fields
+        self.output = output
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(requests_per_minute)
+        self._write_lock = threading.Lock()
+
+    def extract_document(self, document_type, path, has_middle_name):
+        with open(path, "rb") as file:
+            image_bytes = file.read()
+        tracing.count("batch.input_bytes", len(image_bytes))
+        for attempt in range(1, RATE_LIMIT_RETRIES + 1):
+            try:
+                return self.extract_fields(image_bytes, document_type, has_middle_name, before_request=self.limiter.acquire)
+            except (openai.RateLimitError, CircuitOpenError) as error:
+                # Upstream.call has already retried; slow the whole batch down before trying again
+                pause = _retry_after_seconds(error)
+                self.limiter.pause(pause)
+                tracing.count("batch.rate_limited")
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise
+                logger.warning("Rate limited on %s; pausing the batch for %.0fs", path, pause)
+
+    def process(self, packet):
+        """Extracts every document in the packet; returns the output record."""
+        started = time.perf_counter()
+        documents, errors = {}, {}
+        has_middle_name = packet.get("has_middle_name") or {}
+        with tracing.span("batch.applicant", documents=len(packet["documents"])):
+            for document_type, path in packet["documents"].items():
+                try:
+                    documents[document_type] = self.extract_document(
+                        document_type, path, has_middle_name.get(document_type, document_type == "ID")
+                    )
+                except Exception as error:
+                    logger.warning("%s: couldn't read %s (%s)", packet["applicant"], path, error)
+                    errors[document_type] = f"{type(error).__name__}: {error}"
+        return {
+            "applicant": packet["applicant"],
+            "profile": merge_profile(documents),
+            "documents": documents,
+            "errors": errors,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def write(self, record):
+        with self._write_lock:
+            self.output.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self.output.flush()
+
+
+def run_batch(packets, output_path, max_workers=BATCH_MAX_WORKERS, requests_per_minute=BATCH_REQUESTS_PER_MINUTE,
+              retry_failed=False):
+    """Extracts every packet not already in output_path, appending one JSON line per applicant.
+
+    Documents of different applicants run concurrently on `max_workers` threads
+    (one packet per worker). Returns counts of processed, skipped and failed applicants.
+    """
+    checkpoint = read_checkpoint(output_path)
+    pending = [
+        packet for packet in packets
+        if packet["applicant"] not in checkpoint or (retry_failed and checkpoint[packet["applicant"]]["errors"])
+    ]
+    summary = {"applicants": len(packets), "skipped": len(packets) - len(pending), "processed": 0, "failed": 0}
+    if not pending:
+        return summary
+    logger.info("%d applicants to process, %d already done", len(pending), summary["skipped"])
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    _end_partial_line(output_path)
+    started = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as output:
+        run = BatchRun(output, max_workers, requests_per_minute)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [executor.submit(run.process, packet) for packet in pending]
+            try:
+                for future in as_completed(futures):
+                    record = future.result()
+                    run.write(record)
+                    summary["processed"] += 1
+                    summary["failed"] += bool(record["errors"])
+                    if summary["processed"] % PROGRESS_EVERY == 0 or summary["processed"] == len(pending):
+                        elapsed = time.perf_counter() - started
+                        rate = summary["processed"] / elapsed
+                        logger.info("%d/%d applicants (%d with errors), %.1f/min, about %.0f min left",
+                                    summary["processed"], len(pending), summary["failed"], rate * 60,
+                                    (len(pending) - summary["processed"]) / rate / 60)
+            except KeyboardInterrupt:
+                # Finished applicants are already written; the rest are picked up on the next run
+                for future in futures:
+                    future.cancel()
+                raise
+    return summary
+
+
+def _retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after")) if response is not None else RATE_LIMIT_PAUSE_SECONDS
+    except (TypeError, ValueError):
+        return RATE_LIMIT_PAUSE_SECONDS
+
+
+def _end_partial_line(path):
+    # A run killed mid-write leaves a line without its newline; don't glue the next record onto it
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as file:
+        file.seek(-1, os.SEEK_END)
+        if file.read(1) != b"\n":
+            file.write(b"\n")
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of applicant folders, or a JSONL manifest")
+    parser.add_argument("--output", required=True, help="JSONL file of profiles; also the checkpoint")
+    parser.add_argument("--workers", type=int, default=BATCH_MAX_WORKERS)
+    parser.add_argument("--requests-per-minute", type=float, default=BATCH_REQUESTS_PER_MINUTE)
+    parser.add_argument("--retry-failed", action="store_true", help="redo applicants whose last run had errors")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    summary = run_batch(load_packets(args.source), args.output, args.workers, args.requests_per_minute,
+                        args.retry_failed)
+    print("%(processed)d applicants processed (%(failed)d with errors), %(skipped)d already done" % summary)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""Replays recorded traffic against local OpenAI/Pinecone stand-ins and reports latency and throughput.
+
+Each line of the traffic file is one simulated user session:
+
+    {"session": "s1", "uploads": [{"document_type": "ID", "path": "scans/id.jpg"},
+                                  {"document_type": "ITR", "synthetic": [2000, 1500]}],
+     "chat": ["Magandang araw po", "Anong loan ang bagay sa sari-sari store?"],
+     "form": [{"label": "Loan Amount", "value": "500000"}, {"label": "Civil Status", "value": "Married"}],
+     "think_seconds": 0.5}
+
+Uploads go through extraction.extract_documents, as the eligibility form does.
+Chat messages are typed into pages/chatbot.py, and form edits are made on main.py's
+loan application form, with Streamlit's AppTest, one app per session, so each
+interaction measures the server-side script run. AppTest always reruns the whole
+script; the loan_form.section_* stages show what a fragment-only rerun costs.
+`--sessions` sessions run at once. AppTest drives one process-wide Streamlit
+runtime, so script runs from different sessions take turns: uploads and think
+time overlap, but the chat_/form_ script and page load timings are measured one
+run at a time (time spent waiting for another session's run is not included).
+fake_services.py runs in a subprocess (its memory isn't counted), and every
+endpoint's latency can be set with --latency.
+
+Results are appended to data/benchmark_results.jsonl with the git commit, and
+compared with the previous run of the same traffic file and concurrency:
+
+    python benchmark.py data/benchmark_traffic.jsonl --sessions 8
+    python benchmark.py data/benchmark_traffic.jsonl --sessions 8 --latency vision=4:0.5 --label slow-vision
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timezone
+
+import metrics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_PATH = os.path.join(ROOT, "data", "benchmark_results.jsonl")
+CHAT_PAGE = os.path.join("pages", "chatbot.py")
+MAIN_PAGE = "main.py"
+
+# AppTest sets up and tears down Streamlit's global runtime on every run, so
+# two sessions' apps can't run at the same time in one process
+app_run_lock = threading.Lock()
+
+
+def start_fake_services(latency_specs, seed):
+    command = [sys.executable, os.path.join(ROOT, "fake_services.py"), "--port", "0"]
+    for spec in latency_specs:
+        command += ["--latency", spec]
+    if seed is not None:
+        command += ["--seed", str(seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    banner = process.stdout.readline()
+    if "listening on" not in banner:
+        process.kill()
+        raise SystemExit("fake_services.py did not start")
+    return process, banner.strip().rsplit(" ", 1)[-1]
+
+
+def point_app_at(base_url, workdir, backend):
+    """Environment for the app modules; must be set before they are imported."""
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "OPENAI_API_BASE": f"{base_url}/v1",
+        "PINECONE_API_KEY": "benchmark",
+        "PINECONE_INDEX_HOST": base_url,
+        "RETRIEVAL_BACKEND": backend,
+        # Fresh caches, so the run measures misses the way a new deployment sees them
+        "EXTRACTION_CACHE_PATH": os.path.join(workdir, "extraction.sqlite3"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite3"),
+        "RETRIEVAL_CACHE_PATH": os.path.join(workdir, "retrievals.sqlite3"),
+        "CHAT_SESSION_STORE": "memory",
+        "PROFILE_STORE": "memory",
+        "BM25_PARAMS_PATH": os.path.join(workdir, "bm25_params.npz"),
+        # No tiktoken download: the harness runs offline and its queries are short
+        "EMBEDDING_CHECK_CTX_LENGTH": "0",
+    })
+    # The fake index serves chunks of fake_services.REPLY_WORDS; fit the sparse encoder on them
+    from bm25_model import TaglishBM25Encoder
+    from fake_services import REPLY_WORDS
+
+    TaglishBM25Encoder().fit([" ".join(REPLY_WORDS[start:]) for start in range(0, len(REPLY_WORDS), 4)]).save(
+        os.environ["BM25_PARAMS_PATH"]
+    )
+
+
+def synthetic_scan(width, height, seed):
+    """A phone-photo-sized JPEG with enough noise that it doesn't compress away."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(120, 230, width, dtype=np.float32)[None, :, None]
+    pixels = np.clip(gradient + rng.normal(0, 25, (height, width, 3)), 0, 255).astype(np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def load_upload(upload, seed):
+    if "path" in upload:
+        with open(upload["path"], "rb") as file:
+            return file.read()
+    width, height = upload.get("synthetic", (2000, 1500))
+    return synthetic_scan(width, height, seed)
+
+
+def run_uploads(session, number):
+    from extraction import extract_documents
+
+    documents = [
+        (upload["document_type"], load_upload(upload, seed=number * 100 + position), upload["document_type"] == "ID")
+        for position, upload in enumerate(session.get("uploads", []))
+    ]
+    if not documents:
+        return 0
+    started = time.perf_counter()
+    errors = 0
+    for _, _, error in extract_documents(documents):
+        metrics.observe("benchmark.upload_document_seconds", time.perf_counter() - started)
+        errors += error is not None
+    metrics.observe("benchmark.upload_set_seconds", time.perf_counter() - started)
+    metrics.increment("benchmark.uploads", len(documents))
+    metrics.increment("benchmark.errors", errors)
+    return len(documents)
+
+
+def run_chat(session, number):
+    from streamlit.testing.v1 import AppTest
+
+    messages = session.get("chat", [])
+    if not messages:
+        return 0
+    app = AppTest.from_file(CHAT_PAGE, default_timeout=300)
+    app.session_state["chat_session_id"] = f"benchmark-{number}-{session.get('session', number)}"
+    with app_run_lock:
+        started = time.perf_counter()
+        app.run()
+        metrics.observe("benchmark.chat_page_load_seconds", time.perf_counter() - started)
+    for message in messages:
+        time.sleep(session.get("think_seconds", 0))
+        with app_run_lock:
+            started = time.perf_counter()
+            app.chat_input[0].set_value(message).run()
+            metrics.observe("benchmark.chat_script_seconds", time.perf_counter() - started)
+        metrics.increment("benchmark.chat_turns")
+        if app.exception:
+            metrics.increment("benchmark.errors")
+            print("Chat turn failed: %s" % app.exception[0].message, file=sys.stderr)
+            break
+    return len(messages)
+
+
+def find_widget(app, label):
+    for widgets in (app.text_input, app.radio, app.date_input, app.checkbox, app.selectbox):
+        for widget in widgets:
+            if widget.label == label:
+                return widget
+    raise LookupError(f"No widget labelled {label!r}")
+
+
+def run_form(session, number):
+    from streamlit.testing.v1 import AppTest
+
+    edits = session.get("form", [])
+    if not edits:
+        return 0
+    app = AppTest.from_file(MAIN_PAGE, default_timeout=300)
+    with app_run_lock:
+        app.run()
+    with app_run_lock:
+        started = time.perf_counter()
+        app.button(key="loan_application_form").click().run()
+        metrics.observe("benchmark.form_page_load_seconds", time.perf_counter() - started)
+    for edit in edits:
+        time.sleep(session.get("think_seconds", 0))
+        widget = find_widget(app, edit["label"])
+        value = edit["value"]
+        if widget.type == "date_input":
+            value = date.fromisoformat(value)
+        with app_run_lock:
+            started = time.perf_counter()
+            widget.set_value(value).run()
+            metrics.observe("benchmark.form_script_seconds", time.perf_counter() - started)
+        metrics.increment("benchmark.form_edits")
+        if app.exception:
+            metrics.increment("benchmark.errors")
+            print("Form edit failed: %s" % app.exception[0].message, file=sys.stderr)
+            break
+    return len(edits)
+
+
+def replay(sessions, concurrency):
+    """Runs sessions on `concurrency` worker threads; returns wall seconds."""
+    pending = queue.Queue()
+    for number, session in enumerate(sessions):
+        pending.put((number, session))
+
+    def worker():
+        while True:
+            try:
+                number, session = pending.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            try:
+                run_uploads(session, number)
+                run_chat(session, number)
+                run_form(session, number)
+            except Exception as error:
+                metrics.increment("benchmark.errors")
+                print("Session %s failed: %r" % (session.get("session", number), error), file=sys.stderr)
+            metrics.observe("benchmark.session_seconds", time.perf_counter() - started)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, name=f"session-{n}") for n in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(args, wall_seconds, upstream_requests):
+    snapshot = metrics.snapshot()
+    counters = snapshot["counters"]
+    operations = sum(counters.get(name, 0) for name in ("benchmark.uploads", "benchmark.chat_turns", "benchmark.form_edits"))
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": args.label,
+        "traffic": os.path.basename(args.traffic),
+        "sessions": args.sessions,
+        "backend": args.backend,
+        "latency": args.latency,
+        "wall_seconds": wall_seconds,
+        "operations_per_second": operations / wall_seconds if wall_seconds else 0.0,
+        "upstream_requests_per_second": {
+            name: count / wall_seconds for name, count in upstream_requests.items()
+        } if wall_seconds else {},
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "counters": counters,
+        "stages": {name: stats for name, stats in snapshot["distributions"].items() if stats["count"]},
+    }
+
+
+def previous_result(path, result):
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            entry = json.loads(line)
+            if (entry["traffic"], entry["sessions"], entry["backend"]) == (
+                result["traffic"], result["sessions"], result["backend"]
+            ):
+                previous = entry
+    return previous
+
+
+def print_report(result, previous):
+    print("%d sessions at once, %.1fs wall, %.2f ops/s, peak RSS %.0f MiB (commit %s)" % (
+        result["sessions"], result["wall_seconds"], result["operations_per_second"],
+        result["peak_rss_bytes"] / 2**20, result["commit"],
+    ))
+    print("%-42s %7s %9s %9s %9s" % ("stage", "count", "p50", "p95", "p99"))
+    for name, stats in sorted(result["stages"].items()):
+        change = ""
+        before = (previous or {}).get("stages", {}).get(name)
+        if before and before.get("p95"):
+            change = "  p95 %+.0f%% vs %s" % ((stats["p95"] / before["p95"] - 1) * 100, previous["commit"])
+        print("%-42s %7d %9.3f %9.3f %9.3f%s" % (name, stats["count"], stats["p50"], stats["p95"], stats["p99"], change))
+    print("upstream requests/s: " + ", ".join(
+        "%s %.1f" % item for item in sorted(result["upstream_requests_per_second"].items())
+    ))
+    if result["counters"].get("benchmark.errors"):
+        print("errors: %d" % result["counters"]["benchmark.errors"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("traffic", help="JSONL file with one session per line")
+    parser.add_argument("--sessions", type=int, default=4, help="sessions to run at once")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the traffic file this many times")
+    parser.add_argument("--latency", action="append", default=[], metavar="NAME=MEDIAN[:SIGMA]",
+                        help="endpoint latency for fake_services.py (vision, chat, chat_token, embeddings, pinecone)")
+    parser.add_argument("--backend", choices=["pinecone", "local"], default="pinecone")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+
+    with open(args.traffic, encoding="utf-8") as file:
+        sessions = [json.loads(line) for line in file if line.strip()] * args.repeat
+
+    process, base_url = start_fake_services(args.latency, args.seed)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            point_app_at(base_url, workdir, args.backend)
+            wall_seconds = replay(sessions, args.sessions)
+            from urllib.request import urlopen
+
+            with urlopen(f"{base_url}/stats") as response:
+                upstream_requests = json.load(response)
+    finally:
+        process.terminate()
+        process.wait()
+
+    result = summarize(args, wall_seconds, upstream_requests)
+    print_report(result, previous_result(args.results, result))
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+        with open(args.results, "a", encoding="utf-8") as file:
+            file.write(json.dumps(result) + "\n")
+    return 1 if result["counters"].get("benchmark.errors") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""BM25 sparse encoder fitted on our own loan documents.
+
+`BM25Encoder().default()` downloads MS MARCO statistics and tokenizes with an
+English stemmer and stopword list, which mangles Tagalog and weighs terms by
+how common they are in web passages rather than in our knowledge base. This
+module fits the same encoder on the loan documents with a Taglish tokenizer,
+stores the fitted statistics in a small .npz file, and loads it once per process.
+
+Sparse vectors in the index must come from the same encoder as the queries, so
+after fitting, re-encode the index:
+
+    python bm25_model.py fit --from-pinecone     # fit on the chunks stored in Pinecone
+    python bm25_model.py fit --documents DIR     # or on .txt/.md files in DIR
+    python bm25_model.py reindex-pinecone        # rewrite the sparse vectors in Pinecone
+    python local_search.py build --documents DIR # the local index picks up the fitted encoder
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from pinecone_text.sparse import BM25Encoder
+
+logger = logging.getLogger(__name__)
+
+PARAMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "bm25_params.npz")
+TOKENIZER_NAME = "taglish-v1"
+NLTK_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nltk_data")
+
+ENGLISH_STOPWORDS = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "been", "but", "by", "can", "do", "does", "for",
+    "from", "has", "have", "how", "i", "if", "in", "into", "is", "it", "its", "me", "my", "no", "not",
+    "of", "on", "or", "our", "so", "that", "the", "their", "them", "there", "these", "they", "this",
+    "to", "was", "we", "were", "what", "when", "where", "which", "who", "will", "with", "would", "you", "your",
+}
+TAGALOG_STOPWORDS = {
+    "ako", "akin", "ang", "ano", "at", "ay", "ba", "din", "rin", "daw", "raw", "doon", "dito", "ganito",
+    "ganyan", "ikaw", "ito", "iyan", "iyon", "ka", "kami", "kanila", "kaniya", "kay", "kayo", "ko", "kung",
+    "lang", "lamang", "mga", "mo", "na", "naman", "nang", "ng", "ni", "nila", "niya", "nito", "nyo",
+    "pa", "paano", "para", "pero", "po", "ho", "opo", "oho", "sa", "sila", "siya", "tayo", "natin",
+    "namin", "yung", "iyong", "may", "mayroon", "meron", "wala",
+}
+STOPWORDS = ENGLISH_STOPWORDS | TAGALOG_STOPWORDS
+# Verb prefixes split off hyphenated words ("mag-apply"); on their own they carry no meaning
+TAGALOG_PREFIXES = {"i", "ika", "ipag", "ka", "ma", "mag", "maka", "makapag", "maki", "makipag", "na", "nag",
+                    "naka", "nakapag", "pa", "pag", "pang", "nang", "mang"}
+# Words, keeping hyphenated Tagalog forms like "mag-apply" together
+WORD_PATTERN = re.compile(r"[^\W_]+(?:-[^\W_]+)*")
+
+
+def tokenize(text):
+    """Casefolded words minus English and Tagalog stopwords; no stemming, which would mangle Tagalog.
+
+    Hyphenated words also contribute their parts, so "mag-apply" matches "apply".
+    """
+    tokens = []
+    for word in WORD_PATTERN.findall(unicodedata.normalize("NFKC", text).casefold()):
+        parts = word.split("-")
+        if len(parts) > 1:
+            parts = [word, *(part for part in parts if part not in TAGALOG_PREFIXES)]
+        for token in parts:
+            if token not in STOPWORDS and len(token) > 1:
+                tokens.append(token)
+    return tokens
+
+
+class TaglishBM25Encoder(BM25Encoder):
+    """BM25Encoder with the Taglish tokenizer and a compact .npz serialization."""
+
+    def __init__(self, b=0.75, k1=1.2):
+        # BM25Encoder.__init__ would build an NLTK tokenizer (and download its data); we don't need it
+        self.b = b
+        self.k1 = k1
+        self._tokenizer = tokenize
+        self.doc_freq = None
+        self.n_docs = None
+        self.avgdl = None
+
+    def _tf(self, text):
+        counts = Counter(self._hash_text(token) for token in tokenize(text))
+        return list(counts.keys()), list(counts.values())
+
+    def save(self, path=PARAMS_PATH):
+        if self.doc_freq is None:
+            raise ValueError("BM25 must be fit before saving")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            indices=np.fromiter(self.doc_freq.keys(), dtype=np.uint32, count=len(self.doc_freq)),
+            doc_freq=np.fromiter(self.doc_freq.values(), dtype=np.uint32, count=len(self.doc_freq)),
+            scalars=np.array([self.n_docs, self.avgdl, self.b, self.k1], dtype=np.float64),
+            tokenizer=np.array(TOKENIZER_NAME),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_file(cls, path=PARAMS_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["tokenizer"]) != TOKENIZER_NAME:
+                raise ValueError(f"{path} was fitted with tokenizer {data['tokenizer']}, expected {TOKENIZER_NAME}")
+            n_docs, avgdl, b, k1 = data["scalars"].tolist()
+            encoder = cls(b=b, k1=k1)
+            encoder.n_docs = int(n_docs)
+            encoder.avgdl = avgdl
+            encoder.doc_freq = dict(zip(data["indices"].tolist(), data["doc_freq"].tolist()))
+        return encoder
+
+
+@lru_cache(maxsize=None)
+def load_encoder(path=None):
+    """The fitted encoder from BM25_PARAMS_PATH, loaded once per process.
+
+    Falls back to the MS MARCO defaults when no fitted file exists yet, which
+    matches an index whose sparse vectors were built with those defaults.
+    """
+    path = path or os.getenv("BM25_PARAMS_PATH", PARAMS_PATH)
+    if os.path.exists(path):
+        return TaglishBM25Encoder.from_file(path)
+    logger.warning("No fitted BM25 params at %s; using the MS MARCO defaults", path)
+    ensure_nltk_data()
+    return BM25Encoder().default()
+
+
+def ensure_nltk_data():
+    """Makes the NLTK data the default encoder's tokenizer needs available, downloading it at most once.
+
+    data/nltk_data is searched first, so a deployment can ship the files there
+    and skip the download entirely.
+    """
+    import nltk
+
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DATA_DIR)
+    for resource, package in (("tokenizers/punkt_tab", "punkt_tab"), ("corpora/stopwords", "stopwords")):
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            nltk.download(package, download_dir=NLTK_DATA_DIR, quiet=True)
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    import local_search
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fit = subparsers.add_parser("fit", help="fit BM25 on the knowledge base and save it")
+    source = fit.add_mutually_exclusive_group(required=True)
+    source.add_argument("--from-pinecone", action="store_true", help="fit on the chunk texts in PINECONE_INDEX_NAME")
+    source.add_argument("--documents", help="directory of .txt/.md knowledge-base files")
+    fit.add_argument("--output", default=PARAMS_PATH)
+    reindex = subparsers.add_parser("reindex-pinecone", help="re-encode the sparse vectors stored in Pinecone")
+    for subparser in (fit, reindex):
+        subparser.add_argument("--namespace", default="")
+    reindex.add_argument("--params", default=PARAMS_PATH)
+    args = parser.parse_args(argv)
+
+    pinecone_index = None
+    if args.command == "reindex-pinecone" or args.from_pinecone:
+        from pinecone import Pinecone
+
+        pinecone_index = Pinecone(api_key=os.getenv("PINECONE_API_KEY")).Index(os.getenv("PINECONE_INDEX_NAME"))
+
+    if args.command == "fit":
+        if args.from_pinecone:
+            records = local_search.records_from_pinecone(pinecone_index, args.namespace)
+            corpus = [metadata[local_search.TEXT_KEY] for _, _, _, metadata in records]
+        else:
+            corpus = [text for _, text in local_search.load_documents(args.documents)]
+        encoder = TaglishBM25Encoder().fit(corpus)
+        encoder.save(args.output)
+        print("Wrote %s: %d chunks, %d terms, %.1f KB" % (
+            args.output, encoder.n_docs, len(encoder.doc_freq), os.path.getsize(args.output) / 1024,
+        ))
+    else:
+        encoder = TaglishBM25Encoder.from_file(args.params)
+        batch, updated = [], 0
+        for record_id, vector, _, metadata in local_search.records_from_pinecone(pinecone_index, args.namespace):
+            sparse = encoder.encode_documents(metadata[local_search.TEXT_KEY])
+            batch.append({"id": record_id, "values": vector, "sparse_values": sparse, "metadata": metadata})
+            if len(batch) == 100:
+                pinecone_index.upsert(vectors=batch, namespace=args.namespace)
+                updated, batch = updated + len(batch), []
+        if batch:
+            pinecone_index.upsert(vectors=batch, namespace=args.namespace)
+            updated += len(batch)
+        print("Re-encoded %d vectors" % updated)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
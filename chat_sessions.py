@@ -0,0 +1,151 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+
+class ChatSession:
+    """One conversation: the recent messages plus a running summary of the older ones."""
+
+    def __init__(self, messages=(), summary=""):
+        self.history = InMemoryChatMessageHistory(messages=list(messages))
+        self.summary = summary
+        self.last_used = time.time()
+
+
+class MemorySessionStore:
+    """Chat sessions in process memory, keyed by Streamlit session ID.
+
+    Sessions unused for `ttl_seconds` expire, and past `max_sessions` the least
+    recently used one is evicted. Each session keeps at most `max_messages`
+    messages; older ones are dropped, or folded into the session summary when
+    `append_turn` is given a summarizer.
+    """
+
+    def __init__(self, ttl_seconds=3600, max_sessions=1000, max_messages=20):
+        self.ttl = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Returns the session, starting a new one if it is unknown or expired."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._load(session_id) or ChatSession()
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+            session.last_used = now
+            return session
+
+    async def append_turn(self, session_id, query, response, summarize=None):
+        """Records a question and answer, then trims the session to max_messages.
+
+        `summarize(summary, messages)` is an async callable that returns a new
+        summary covering the old summary and the messages being trimmed.
+        """
+        session = self.get(session_id)
+        session.history.add_user_message(query)
+        session.history.add_ai_message(response)
+        overflow = len(session.history.messages) - self.max_messages
+        if overflow > 0:
+            # Trim whole turns so the history never starts with an answer
+            overflow += overflow % 2
+            trimmed = session.history.messages[:overflow]
+            session.history.messages = session.history.messages[overflow:]
+            if summarize is not None:
+                session.summary = await summarize(session.summary, trimmed)
+        self._save(session_id, session)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expire(self, now):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used < self.ttl:
+                break
+            del self._sessions[session_id]
+
+    def _load(self, session_id):
+        return None
+
+    def _save(self, session_id, session):
+        pass
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    """Memory-first session store that writes each turn through to SQLite.
+
+    A session that isn't in memory (after a worker restart, or on another worker)
+    is reloaded from disk as long as it hasn't expired.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chat_sessions (session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, "
+            "summary TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._db_lock = threading.Lock()
+
+    def discard(self, session_id):
+        super().discard(session_id)
+        with self._db_lock:
+            self._db.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def _load(self, session_id):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT messages, summary FROM chat_sessions WHERE session_id = ? AND updated_at > ?",
+                (session_id, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        return ChatSession(messages_from_dict(json.loads(row[0])), row[1])
+
+    def _save(self, session_id, session):
+        now = time.time()
+        messages = json.dumps(messages_to_dict(session.history.messages))
+        with self._db_lock:
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO chat_sessions VALUES (?, ?, ?, ?)",
+                    (session_id, messages, session.summary, now),
+                )
+                self._db.execute("DELETE FROM chat_sessions WHERE updated_at <= ?", (now - self.ttl,))
+
+
+def create_session_store():
+    """Builds the store selected by CHAT_SESSION_STORE ('memory' or 'sqlite')."""
+    backend = os.getenv("CHAT_SESSION_STORE", "memory")
+    options = {
+        "ttl_seconds": float(os.getenv("CHAT_SESSION_TTL_SECONDS", "3600")),
+        "max_sessions": int(os.getenv("CHAT_MAX_SESSIONS", "1000")),
+        "max_messages": int(os.getenv("CHAT_MAX_MESSAGES", "20")),
+    }
+    if backend == "sqlite":
+        return SQLiteSessionStore(os.getenv("CHAT_SESSION_STORE_PATH", ".cache/chat_sessions.sqlite3"), **options)
+    if backend == "memory":
+        return MemorySessionStore(**options)
+    raise ValueError(f"Unknown CHAT_SESSION_STORE backend: {backend}")
@@ -0,0 +1,85 @@
+"""Fits retrieved chunks and chat history into a token budget for the QA prompt.
+
+Tokens are counted locally with tiktoken. Chunks are taken in order of their
+hybrid search score, near-duplicates (overlapping chunks of the same passage)
+are skipped, and history is trimmed from the oldest message until it fits.
+"""
+import logging
+import re
+from functools import lru_cache
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# Share of the smaller chunk's word shingles found in another chunk for them to count as the same passage
+DUPLICATE_SIMILARITY = 0.8
+SHINGLE_WORDS = 5
+# Separator create_stuff_documents_chain puts between documents
+DOCUMENT_SEPARATOR = "\n\n"
+# Rough English/Tagalog average, used only when the tokenizer is unavailable
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def encoding_for(model):
+    """The model's tiktoken encoding, or None if it can't be loaded (tiktoken downloads it on first use)."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.warning("No tiktoken encoding for %s; estimating tokens from characters", model, exc_info=True)
+        return None
+
+
+def count_tokens(text, model="gpt-4-turbo"):
+    encoding = encoding_for(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def select_documents(documents, budget_tokens, model="gpt-4-turbo"):
+    """Highest-scoring, non-overlapping documents that fit in budget_tokens; returns (documents, tokens)."""
+    ranked = sorted(documents, key=lambda document: document.metadata.get("score", 0.0), reverse=True)
+    separator_tokens = count_tokens(DOCUMENT_SEPARATOR, model)
+    selected, selected_shingles, used = [], [], 0
+    for document in ranked:
+        shingles = _shingles(document.page_content)
+        if any(_similarity(shingles, seen) >= DUPLICATE_SIMILARITY for seen in selected_shingles):
+            continue
+        tokens = count_tokens(document.page_content, model) + (separator_tokens if selected else 0)
+        if used + tokens > budget_tokens:
+            # A smaller chunk further down may still fit
+            continue
+        selected.append(document)
+        selected_shingles.append(shingles)
+        used += tokens
+    return selected, used
+
+
+def trim_history(messages, budget_tokens, model="gpt-4-turbo"):
+    """The most recent messages whose combined tokens fit in budget_tokens; returns (messages, tokens)."""
+    kept, used = [], 0
+    for message in reversed(messages):
+        tokens = count_tokens(message.content, model)
+        if used + tokens > budget_tokens:
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+    return kept, used
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.casefold())
+    if len(words) <= SHINGLE_WORDS:
+        return {tuple(words)}
+    return {tuple(words[start:start + SHINGLE_WORDS]) for start in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def _similarity(first, second):
+    # Overlap relative to the smaller chunk, so a chunk contained in another counts as a duplicate
+    return len(first & second) / min(len(first), len(second)) if first and second else 0.0
@@ -0,0 +1,186 @@
+"""Embedding layer that memoizes vectors and batches concurrent requests.
+
+`CachedEmbeddings` wraps a LangChain embeddings model. Vectors are stored as
+float32 blobs in SQLite, keyed by a hash of model name and text, with an
+in-memory LRU in front. Async single-query requests from all sessions are
+held for a few milliseconds and sent as one batched API call. Bulk
+`embed_documents` calls (such as re-embedding the knowledge base) go through
+the same store and only embed texts it hasn't seen.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+
+class EmbeddingStore:
+    """float32 vectors keyed by text hash: an LRU in memory over an optional SQLite file."""
+
+    def __init__(self, path=None, memory_entries=5000):
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._db.commit()
+
+    def get_many(self, keys):
+        """Returns {key: vector} for the keys that are stored."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            missing = [key for key in keys if key not in found]
+            if missing and self._db is not None:
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, vector)
+                        found[key] = vector
+        return found
+
+    def put_many(self, items):
+        """Stores (key, vector) pairs in one transaction."""
+        rows = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in items]
+        with self._lock:
+            for key, vector in rows:
+                self._remember(key, vector)
+            if self._db is not None:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                        [(key, vector.tobytes()) for key, vector in rows],
+                    )
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, model_name, store, batch_window=0.01, max_batch_size=256, bulk_batch_size=512):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = store
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.bulk_batch_size = bulk_batch_size
+        # Async batching state; only touched from the event loop that awaits aembed_query
+        self._pending = []
+        self._flush_timer = None
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\n{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.key(text) for text in texts]
+        found = self.store.get_many(keys)
+        self._count_lookups(len(found), len(keys) - len(found))
+
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        for start in range(0, len(missing), self.bulk_batch_size):
+            batch = missing[start:start + self.bulk_batch_size]
+            vectors = self.embeddings.embed_documents(batch)
+            self._store(batch, vectors, found)
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.aembed_query(text) for text in texts)))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self.key(text)
+        found = self.store.get_many([key])
+        self._count_lookups(len(found), 1 - len(found))
+        if found:
+            return found[key].tolist()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush(loop)
+        elif self._flush_timer is None:
+            # Hold the request briefly so queries from other sessions can share the API call
+            self._flush_timer = loop.call_later(self.batch_window, self._flush, loop)
+        return await future
+
+    def _flush(self, loop):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            loop.create_task(self._embed_batch(batch))
+
+    async def _embed_batch(self, batch):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        metrics.increment("embeddings.api_batches")
+        metrics.observe("embeddings.batch_size", len(texts))
+        try:
+            vectors = await self.embeddings.aembed_documents(texts)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        found = {}
+        self._store(texts, vectors, found)
+        for text, future in batch:
+            if not future.done():
+                future.set_result(found[self.key(text)].tolist())
+
+    def _store(self, texts, vectors, found):
+        items = [(self.key(text), np.asarray(vector, dtype=np.float32)) for text, vector in zip(texts, vectors)]
+        self.store.put_many(items)
+        found.update(items)
+
+    def _count_lookups(self, hits, misses):
+        metrics.increment("embeddings.cache_hits", hits)
+        metrics.increment("embeddings.cache_misses", misses)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_embeddings(model="text-embedding-3-large"):
+    """One CachedEmbeddings per model per process, so batching spans every session."""
+    from langchain_openai import OpenAIEmbeddings
+
+    with _shared_lock:
+        if model not in _shared:
+            store = EmbeddingStore(os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3") or None)
+            _shared[model] = CachedEmbeddings(
+                # The length check tokenizes with tiktoken, which downloads its encodings on first use
+                OpenAIEmbeddings(
+                    model=model, check_embedding_ctx_length=os.getenv("EMBEDDING_CHECK_CTX_LENGTH", "1") != "0"
+                ),
+                model,
+                store,
+                batch_window=float(os.getenv("EMBEDDING_BATCH_WINDOW_SECONDS", "0.01")),
+            )
+        return _shared[model]
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import logging
+import contextvars
+import os
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+import tracing
+from extraction_cache import ExtractionCache
+from extraction_schema import normalize_fields, response_format_for
+from http_clients import openai_client, upstream
+from image_preprocessing import build_data_url, preprocess_image, settings_for
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on concurrent GPT-4o vision calls made by a single extraction run
+EXTRACTION_MAX_WORKERS = int(os.getenv("EXTRACTION_MAX_WORKERS", "4"))
+
+EXTRACTION_MODEL = "gpt-4o"
+
+# Log the peak Python memory used to build each image payload
+TRACE_PAYLOAD_MEMORY = os.getenv("EXTRACTION_TRACE_MEMORY") == "1"
+
+# Shared by every session in the process so a file that stays in a file_uploader
+# is only sent to GPT-4o once, no matter how many times the script reruns
+extraction_cache = ExtractionCache(
+    path=os.getenv("EXTRACTION_CACHE_PATH", ".cache/extraction_cache.sqlite3"),
+    memory_entries=int(os.getenv("EXTRACTION_CACHE_MEMORY_ENTRIES", "256")),
+    max_disk_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+)
+
+DOCUMENT_LABELS = {
+    "ID": "Government Valid ID",
+    "DTI": "DTI Certificate",
+    "ITR": "ITR",
+    "Bank_Statement": "Bank Statement",
+}
+
+
+def build_image_payload(image_bytes, document_type):
+    """Turns an upload buffer into the data URL sent to GPT-4o without intermediate copies."""
+    with tracing.span("extraction.preprocess", document_type=document_type):
+        if not TRACE_PAYLOAD_MEMORY:
+            jpeg_bytes, stats = preprocess_image(image_bytes, document_type)
+            image_url = build_data_url(jpeg_bytes)
+        else:
+            image_url, stats = _build_image_payload_traced(image_bytes, document_type)
+        tracing.count("extraction.upload_bytes", stats["original_bytes"])
+        tracing.count("extraction.payload_bytes", stats["processed_bytes"])
+        return image_url
+
+
+def _build_image_payload_traced(image_bytes, document_type):
+    # tracemalloc only sees Python allocations (the byte and string copies), not PIL's
+    # pixel buffers, and its peak is process-wide, so concurrent uploads share one figure
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    jpeg_bytes, stats = preprocess_image(image_bytes, document_type)
+    image_url = build_data_url(jpeg_bytes)
+    _, peak = tracemalloc.get_traced_memory()
+    logger.info(
+        "Payload for %s: %d input bytes, %d JPEG bytes, %d URL chars, peak traced memory %d bytes",
+        document_type, stats["original_bytes"], stats["processed_bytes"], len(image_url), peak,
+    )
+    return image_url, stats
+
+def build_extraction_prompt(document_type, has_middle_name):
+    """Builds the text part of the GPT-4o extraction request for a document type."""
+    # Adjust prompt based on document type
+    middle_name_instructions = {
+        True: (
+                "- Middle Name: If the name format is 'Last, First Middle' and the middle name checkbox is ticked, "
+                "treat the last word after the first name as the middle name. Do not skip the middle name unless it is clearly missing. "
+                "For example, if the name is 'PAMONAG, JAPHET VANCE MACESAR', extract 'JAPHET VANCE' as First Name, 'MACESAR' as Middle Name, and 'PAMONAG' as Last Name."),
+        False: (
+                "- Middle Name: If the middle name checkbox is not ticked, classify everything after the last name as part of the first name. "
+                "Do not extract a middle name; return null for the middle name field.")
+    }
+
+    document_type_instructions = {
+        "ID": (f"""You are receiving an image of a government-issued primary ID from the Philippines. The ID will contain the following fields, which you should extract with precision:
+                    - First Name (labeled as 'Pangalan' or 'Given Names')
+                    {middle_name_instructions[has_middle_name]}
+                    - Last Name (labeled as 'Apelyido' or 'Surname')
+                    - Birth Date (labeled as 'Petsa ng kapanganakan' or 'Date of birth' use this format 'YYYY-MM-DD')
+
+                    When the format is "Last, First Middle":
+                    - If the middle name checkbox is ticked, treat the last word after the first name as the middle name. Do not skip the middle name unless it is clearly missing.
+                    - If the middle name checkbox is not ticked, classify everything after the last name as part of the first name, and do not extract a middle name. Return null for the middle name field."""),
+
+        "DTI": (f"""You are receiving an image of a Department of Trade and Industry (DTI) Certificate from the Philippines. The certificate will contain the following fields, which you should extract with precision:
+                    - Business Name (labeled as 'Business Name')
+                    - Business Owner (labeled as 'Issued to')
+                    - Business Expiry Date (labeled as 'valid from')"""),
+
+        "ITR": (f"""You are receiving an image of an Income Tax Return (ITR) from the Philippines. The ITR will contain the following fields, which you should extract with precision:
+                    - Taxpayer Name (labeled as 'Taxpayer Name')
+                    - Taxpayer TIN (labeled as 'Taxpayer TIN' or 'TIN')
+                    - Taxpayer Address (labeled as 'Taxpayer Address' or 'Registered Address')
+                    - RDO Code (labeled as 'RDO Code')
+                    - Zip Code (labeled as 'Zip Code' containing 3 digits for example '000')
+                    - Date of Birth (labeled as 'Date of Birth')
+                    - Telephone Number (labeled as 'Telephone Number')
+                    - Line of Business (labeled as 'Line of Business')
+                    - Method of Deduction (labeled as 'Method of Deduction' options are 'Itemized Deduction' or 'Optional Standard Deduction' marked with an x)
+                    - Revenue (labeled as 'Sales/Revenues/Receipts/Fees' or '26A)
+                    - Total Revenue (labeled as 'Total' or '28A')
+                    - Gross Income (labeled as 'Gross Income from Operation' or '32A')
+                    - Total Deductions (labeled as 'Total Deductions' or '33A')
+                    - Taxable Income (labeled as 'Taxable Income' or '34A')
+                    - Taxable Income to Date (labeled as 'Taxable Income to Date' or '36A')
+                    - Total Tax Due (labeled as 'Total Tax Due' or '37A')
+                    - Tax Payment (labeled as 'Tax Payment' or '39A')
+                    - Total Amount Payable (labeled as 'Total Amount Payable' or '41A')"""),
+
+        "Bank_Statement": (f"""You are receiving an image of a Bank Statement from the Philippines. The Bank Statement will contain the following fields, which you should extract with precision:
+                    - Bank Name (labeled as 'Bank Name' and usually located at the top of the statement)
+                    - Bank Branch (labeled as 'Branch' or 'Branch Name' and usually located below the Bank Name)
+                    - Account Holder Name (labeled as 'Account Name' or 'Account Holder Name')
+                    - Account Holder Address (labeled as 'Account Address' or 'Account Holder Address')
+                    - Account Number (labeled as 'Primary Account Number')
+                    - Account Type (labeled as 'Account Type' or 'Type of Account')
+                    - Statement Date (labeled as 'Statement Date' or 'Date')
+                    - Other Account Type (labeled as 'Deposits & Other Credits' or 'Description')
+                    - Other Account Date Credited (labeled as 'Date Credited' or 'Date')""")
+
+    }
+
+    return f"""
+                    {document_type_instructions.get(document_type, "Invalid document type. Please provide a valid document type.")}
+                    Return the fields as JSON using the field names above. Use null for any field that is missing or unreadable; do not guess.
+                    """.strip()
+
+
+def prompt_fingerprint(document_type, has_middle_name):
+    """Hash of everything besides the image that shapes the model's answer."""
+    prompt = build_extraction_prompt(document_type, has_middle_name)
+    # Resizing or recompressing the image differently can change what the model reads
+    preprocessing = json.dumps(settings_for(document_type), sort_keys=True)
+    schema = json.dumps(response_format_for(document_type), sort_keys=True)
+    return hashlib.sha256(f"{EXTRACTION_MODEL}\n{preprocessing}\n{schema}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def build_extraction_request(image_bytes, document_type, has_middle_name):
+    """Chat completions parameters for extracting one document; also used for Batch API requests."""
+    image_url = build_image_payload(image_bytes, document_type)
+    return {
+        "model": EXTRACTION_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": build_extraction_prompt(document_type, has_middle_name)},
+                    {"type": "image_url", "image_url": {"url": image_url}}
+                ]
+            }
+        ],
+        "response_format": response_format_for(document_type),
+        "max_tokens": 2048,
+    }
+
+
+def extract_raw_text_from_img_openai_all(image_bytes, document_type, has_middle_name):
+    """Extracts text from the image using GPT-4o (OpenAI Vision) with structured extraction instructions."""
+    request = build_extraction_request(image_bytes, document_type, has_middle_name)
+
+    # Queues behind the per-process vision limit, then retries transient failures. The
+    # client is built on first use, so the batch tools can import this module without a key
+    with tracing.span("extraction.vision_call", document_type=document_type, model=EXTRACTION_MODEL):
+        response = upstream("openai-vision").call(openai_client().chat.completions.create, **request)
+        if response.usage is not None:
+            tracing.count("extraction.prompt_tokens", response.usage.prompt_tokens)
+            tracing.count("extraction.completion_tokens", response.usage.completion_tokens)
+
+    message = response.choices[0].message
+    if getattr(message, "refusal", None):
+        raise ValueError(f"Model refused to extract the {document_type}: {message.refusal}")
+    raw_text = message.content
+    return raw_text
+
+
+def parse_extracted_fields(output, document_type):
+    """Turns the JSON returned by the model into a dict of normalized form fields."""
+    with tracing.span("extraction.parse", document_type=document_type):
+        return normalize_fields(json.loads(output), document_type)
+
+
+def extract_fields(image_bytes, document_type, has_middle_name, before_request=None):
+    """Normalized fields for one document, from the cache or GPT-4o.
+
+    `before_request`, if given, is called just before the model is (and only if it is) called,
+    for example to wait for a rate limiter.
+    """
+    with tracing.span("extraction.document", document_type=document_type) as current:
+        cache_key = extraction_cache.make_key(
+            image_bytes, document_type, has_middle_name, prompt_fingerprint(document_type, has_middle_name)
+        )
+        output = extraction_cache.get(cache_key)
+        current.set("cache_hit", output is not None)
+        if output is not None:
+            return parse_extracted_fields(output, document_type)
+
+        if before_request is not None:
+            before_request()
+        output = extract_raw_text_from_img_openai_all(image_bytes, document_type, has_middle_name)
+        fields = parse_extracted_fields(output, document_type)
+        # Only cache replies that parsed, otherwise a bad reply would be served forever
+        extraction_cache.set(cache_key, output)
+        return fields
+
+
+def extract_documents(documents, max_workers=EXTRACTION_MAX_WORKERS):
+    """Sends all pending documents to GPT-4o at once on a bounded thread pool.
+
+    `documents` is a list of (document_type, image_bytes, has_middle_name) tuples.
+    Yields (document_type, fields, error) as each document finishes, so callers can
+    report progress per document; `error` is None on success.
+    """
+    if not documents:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(documents)))) as executor:
+        # Each worker runs in a copy of the caller's context, so its spans nest under the caller's
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run, extract_fields, image_bytes, document_type, has_middle_name
+            ): document_type
+            for document_type, image_bytes, has_middle_name in documents
+        }
+        for future in as_completed(futures):
+            document_type = futures[future]
+            try:
+                yield document_type, future.result(), None
+            except Exception as error:
+                yield document_type, {}, error
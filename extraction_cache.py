@@ -0,0 +1,112 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+class ExtractionCache:
+    """Two-tier cache for GPT-4o extraction replies.
+
+    Entries are keyed on the image content plus everything that shapes the reply
+    (document type, middle name flag and prompt fingerprint). The memory tier is an
+    LRU of recent entries; the SQLite tier survives restarts and is shared by every
+    worker pointed at the same file. Both tiers expire entries after `ttl_seconds`,
+    and the disk tier keeps at most `max_disk_entries`, dropping the least recently used.
+    Lookups are counted in metrics as extraction.cache{outcome=memory_hit|disk_hit|miss}.
+    """
+
+    def __init__(self, path=None, memory_entries=256, max_disk_entries=5000, ttl_seconds=7 * 24 * 3600):
+        self.memory_entries = memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS extractions_accessed_at ON extractions (accessed_at)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(image_bytes, document_type, has_middle_name, prompt_hash):
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        return hashlib.sha256(
+            f"{image_hash}|{document_type}|{bool(has_middle_name)}|{prompt_hash}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    metrics.increment("extraction.cache", outcome="memory_hit")
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM extractions WHERE key = ? AND created_at > ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    self._db.execute("UPDATE extractions SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, created_at, value)
+                    metrics.increment("extraction.cache", outcome="disk_hit")
+                    return value
+
+            metrics.increment("extraction.cache", outcome="miss")
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO extractions (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._db.execute("DELETE FROM extractions WHERE created_at <= ?", (now - self.ttl,))
+            self._db.execute(
+                "DELETE FROM extractions WHERE key IN "
+                "(SELECT key FROM extractions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+            self._db.commit()
+
+    def stats(self):
+        memory_hits = metrics.counter("extraction.cache", outcome="memory_hit")
+        disk_hits = metrics.counter("extraction.cache", outcome="disk_hit")
+        misses = metrics.counter("extraction.cache", outcome="miss")
+        lookups = memory_hits + disk_hits + misses
+        with self._lock:
+            memory_entries = len(self._memory)
+        return {
+            "memory_hits": memory_hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": (memory_hits + disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": memory_entries,
+        }
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,108 @@
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+# Fields requested from each document, in the names the forms read them by
+DOCUMENT_FIELDS = {
+    "ID": ["First Name", "Middle Name", "Last Name", "Birth Date"],
+    "DTI": ["Business Name", "Business Owner", "Business Expiry Date"],
+    "ITR": [
+        "Taxpayer Name", "Taxpayer TIN", "Taxpayer Address", "RDO Code", "Zip Code", "Date of Birth",
+        "Telephone Number", "Line of Business", "Method of Deduction", "Revenue", "Total Revenue",
+        "Gross Income", "Total Deductions", "Taxable Income", "Taxable Income to Date", "Total Tax Due",
+        "Tax Payment", "Total Amount Payable",
+    ],
+    "Bank_Statement": [
+        "Bank Name", "Bank Branch", "Account Holder Name", "Account Holder Address", "Account Number",
+        "Account Type", "Statement Date", "Other Account Type", "Other Account Date Credited",
+    ],
+}
+
+DATE_FIELDS = {"Birth Date", "Date of Birth", "Business Expiry Date", "Statement Date"}
+
+AMOUNT_FIELDS = {
+    "Revenue", "Total Revenue", "Gross Income", "Total Deductions", "Taxable Income",
+    "Taxable Income to Date", "Total Tax Due", "Tax Payment", "Total Amount Payable",
+}
+
+TIN_FIELDS = {"Taxpayer TIN"}
+
+# Philippine documents mostly print month-first numeric dates
+DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%m-%d-%Y", "%d %B %Y", "%d %b %Y", "%B %d, %Y", "%b %d, %Y", "%B %d %Y"]
+
+MISSING_VALUES = {"", "not found", "n/a", "na", "none", "null"}
+
+
+def response_format_for(document_type):
+    """Structured-output schema that makes GPT-4o return exactly this document's fields."""
+    fields = DOCUMENT_FIELDS[document_type]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": f"{document_type.lower()}_fields",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {field: {"type": ["string", "null"]} for field in fields},
+                "required": fields,
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def normalize_fields(raw_fields, document_type):
+    """Validates and normalizes a model reply in one pass over the document's fields.
+
+    Values are stripped, missing values are dropped so the forms fall back to their
+    defaults, dates become ISO strings, amounts become plain decimal strings
+    ("PHP 1,250,000.00" -> "1250000.00") and TINs are formatted as
+    000-000-000-000. Values that don't parse are kept as stripped text.
+    """
+    if not isinstance(raw_fields, dict):
+        raise ValueError(f"Expected a JSON object for {document_type}, got {type(raw_fields).__name__}")
+
+    fields = {}
+    for field in DOCUMENT_FIELDS[document_type]:
+        value = raw_fields.get(field)
+        if value is None:
+            continue
+        value = " ".join(str(value).split())
+        if value.lower() in MISSING_VALUES:
+            continue
+        if field in DATE_FIELDS:
+            value = _normalize_date(value)
+        elif field in AMOUNT_FIELDS:
+            value = _normalize_amount(value)
+        elif field in TIN_FIELDS:
+            value = _normalize_tin(value)
+        fields[field] = value
+    return fields
+
+
+def _normalize_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return value
+
+
+def _normalize_amount(value):
+    cleaned = re.sub(r"[^\d.\-]", "", value)
+    try:
+        # Checked with Decimal but kept as text: the profile feeds text widgets and JSON
+        return str(Decimal(cleaned))
+    except InvalidOperation:
+        return value
+
+
+def _normalize_tin(value):
+    digits = re.sub(r"\D", "", value)
+    if len(digits) not in (9, 12, 14):
+        return value
+    groups = [digits[0:3], digits[3:6], digits[6:9]]
+    if len(digits) > 9:
+        groups.append(digits[9:])
+    return "-".join(groups)
@@ -0,0 +1,228 @@
+"""Local stand-ins for the OpenAI and Pinecone APIs, for benchmarks and offline runs.
+
+One HTTP server answers the OpenAI endpoints the app uses (chat completions,
+streamed or not, including vision extraction with a JSON schema, and
+embeddings) and the Pinecone data-plane endpoints (query, describe_index_stats).
+Each endpoint sleeps for a latency drawn from a log-normal distribution, so
+benchmarks see realistic, configurable tail latencies without network access:
+
+    python fake_services.py --port 8900 --latency vision=2.5:0.4 --latency chat_token=0.02
+
+Then point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8900/v1 and
+PINECONE_INDEX_HOST=http://127.0.0.1:8900.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Median seconds and log-normal sigma per endpoint
+DEFAULT_LATENCIES = {
+    "vision": (2.5, 0.35),
+    "chat": (0.4, 0.3),          # time to first token, or the whole reply when not streaming
+    "chat_token": (0.02, 0.2),   # between streamed tokens
+    "embeddings": (0.15, 0.3),
+    "pinecone": (0.05, 0.3),
+}
+EMBEDDING_DIMENSIONS = 3072
+REPLY_WORDS = (
+    "Ayon sa BPI, ang Ready Loan ay para sa working capital ng maliliit na negosyo. "
+    "Pwede ko po bang malaman kung ilang taon na ang inyong negosyo?"
+).split()
+
+
+def parse_latency(spec):
+    """'name=median[:sigma]' -> (name, (median, sigma))."""
+    name, _, value = spec.partition("=")
+    median, _, sigma = value.partition(":")
+    return name, (float(median), float(sigma) if sigma else DEFAULT_LATENCIES.get(name, (0, 0.3))[1])
+
+
+class FakeServices:
+    def __init__(self, latencies=None, seed=None):
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, name):
+        median, sigma = self.latencies[name]
+        with self._lock:
+            seconds = median * math.exp(self._random.gauss(0, sigma)) if median > 0 else 0.0
+        time.sleep(seconds)
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.requests)
+
+
+def fake_embedding(value, dimensions=EMBEDDING_DIMENSIONS):
+    """Deterministic unit vector for a text (or token list), so repeated texts embed the same."""
+    seed = hashlib.sha256(json.dumps(value).encode("utf-8")).digest()
+    generator = random.Random(seed)
+    vector = [generator.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(component * component for component in vector))
+    return [component / norm for component in vector]
+
+
+def schema_reply(response_format):
+    """A reply that satisfies a strict json_schema response format: every field present and null."""
+    properties = response_format["json_schema"]["schema"].get("properties", {})
+    return json.dumps({name: None for name in properties})
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    services = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.route()
+
+    def do_POST(self):
+        self.route()
+
+    def route(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            self.chat_completions(body)
+        elif path.endswith("/embeddings"):
+            self.embeddings(body)
+        elif path == "/query":
+            self.pinecone_query(body)
+        elif path == "/describe_index_stats":
+            self.services.count("pinecone.describe_index_stats")
+            self.send_json({"namespaces": {"": {"vectorCount": 1000}}, "dimension": EMBEDDING_DIMENSIONS,
+                            "indexFullness": 0.0, "totalVectorCount": 1000})
+        elif path == "/stats":
+            self.send_json(self.services.stats())
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def chat_completions(self, body):
+        is_vision = any(
+            isinstance(message.get("content"), list)
+            and any(part.get("type") == "image_url" for part in message["content"])
+            for message in body.get("messages", [])
+        )
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            content = schema_reply(response_format)
+        elif body.get("stream"):
+            content = None
+        else:
+            # Non-streamed chat calls are question rewrites and summaries; echo the question
+            content = str(body["messages"][-1].get("content", ""))
+        name = "vision" if is_vision else "chat"
+        self.services.count(f"openai.{name}")
+
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model", "fake")}
+        if not body.get("stream"):
+            self.services.delay(name)
+            self.send_json({
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content, "refusal": None}}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+            })
+            return
+
+        self.services.delay(name)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = [content] if content is not None else [word + " " for word in REPLY_WORDS]
+        for number, word in enumerate(words):
+            if number:
+                self.services.delay("chat_token")
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"role": "assistant", "content": word}, "finish_reason": None}]}
+            self.send_chunk(f"data: {json.dumps(chunk)}\n\n")
+        done = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self.send_chunk(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def embeddings(self, body):
+        self.services.count("openai.embeddings")
+        inputs = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = body.get("dimensions") or EMBEDDING_DIMENSIONS
+        self.services.delay("embeddings")
+        self.send_json({
+            "object": "list", "model": body.get("model", "fake"),
+            "data": [{"object": "embedding", "index": number, "embedding": fake_embedding(value, dimensions)}
+                     for number, value in enumerate(inputs)],
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        })
+
+    def pinecone_query(self, body):
+        self.services.count("pinecone.query")
+        self.services.delay("pinecone")
+        top_k = body.get("topK", 4)
+        self.send_json({
+            "namespace": body.get("namespace", ""),
+            "matches": [
+                {"id": f"chunk-{number}", "score": 0.9 - number * 0.05,
+                 "metadata": {"context": f"Chunk {number}: " + " ".join(REPLY_WORDS)}}
+                for number in range(top_k)
+            ],
+            "usage": {"readUnits": 1},
+        })
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def serve(port=0, latencies=None, seed=None):
+    """Starts the fake services on a background thread; returns the server (server.server_port is the port)."""
+    handler = type("FakeServicesHandler", (Handler,), {"services": FakeServices(latencies, seed)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-services", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", action="append", default=[], metavar="NAME=MEDIAN[:SIGMA]",
+                        help=f"override an endpoint's latency; names: {', '.join(DEFAULT_LATENCIES)}")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    server = serve(args.port, dict(parse_latency(spec) for spec in args.latency), args.seed)
+    print("Fake OpenAI and Pinecone listening on http://127.0.0.1:%d" % server.server_port, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
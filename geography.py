@@ -0,0 +1,222 @@
+"""Bundled Philippine Standard Geographic Code (PSGC) snapshot for the address selectors.
+
+The app reads region, province and city names from data/psgc.sqlite3 instead of
+calling psgc.gitlab.io at startup. To rebuild the snapshot:
+
+    python geography.py refresh                        # from the psgc.gitlab.io API
+    python geography.py refresh --source psgc-package  # from the `psgc` PyPI package data
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from http_clients import PSGC_TIMEOUT, requests_session, upstream
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "psgc.sqlite3")
+SNAPSHOT_FORMAT_VERSION = 1
+
+PSGC_API_URL = "https://psgc.gitlab.io/api"
+
+NCR_REGION_CODE = "130000000"
+# NCR has no provinces; its cities are listed under this name in the province selector
+NCR_PROVINCE_NAME = "Metro Manila"
+
+
+class Geography:
+    """Region, province and city names with the lookups the forms need, built once per process."""
+
+    def __init__(self, regions, provinces, cities, meta):
+        self.meta = meta
+        self.version = meta.get("version", "")
+        self.region_names = tuple(name for _, name in regions)
+        self.province_names = tuple(name for _, name, _ in provinces)
+
+        province_names = {code: name for code, name, _ in provinces}
+        cities_by_province = {}
+        for _, name, province_code in cities:
+            cities_by_province.setdefault(province_names[province_code], []).append(name)
+
+        # Rows are stored sorted, so these lists are already in display order
+        self.cities_by_province = {province: tuple(names) for province, names in cities_by_province.items()}
+
+    def cities_in(self, province_name):
+        return self.cities_by_province.get(province_name, ())
+
+
+@lru_cache(maxsize=None)
+def load_geography(path=SNAPSHOT_PATH):
+    """Reads the snapshot once per process; later calls return the same object."""
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        meta = dict(db.execute("SELECT key, value FROM meta"))
+        regions = db.execute("SELECT code, name FROM regions ORDER BY position").fetchall()
+        provinces = db.execute("SELECT code, name, region_code FROM provinces ORDER BY position").fetchall()
+        cities = db.execute("SELECT code, name, province_code FROM cities ORDER BY position").fetchall()
+    finally:
+        db.close()
+    return Geography(regions, provinces, cities, meta)
+
+
+def fetch_from_api(session=None, timeout=PSGC_TIMEOUT):
+    """Downloads regions, provinces and cities/municipalities from psgc.gitlab.io."""
+    session = session or requests_session()
+
+    def fetch(endpoint):
+        response = session.get(f"{PSGC_API_URL}/{endpoint}/", timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get(endpoint):
+        return upstream("psgc").call(fetch, endpoint)
+
+    regions = [{"code": region["code"], "name": region["name"]} for region in get("regions")]
+    provinces = [
+        {"code": province["code"], "name": province["name"], "region_code": province["regionCode"]}
+        for province in get("provinces")
+    ]
+    cities = [
+        {
+            "code": city["code"],
+            "name": city["name"],
+            "region_code": city["regionCode"],
+            "province_code": city.get("provinceCode") or None,
+        }
+        for city in get("cities-municipalities")
+    ]
+    return regions, provinces, cities, "psgc.gitlab.io"
+
+
+def fetch_from_psgc_package():
+    """Reads the PSA release bundled with the `psgc` PyPI package, using 9-digit codes like the API."""
+    spec = importlib.util.find_spec("psgc")
+    if spec is None or not spec.submodule_search_locations:
+        raise RuntimeError("The psgc package is not installed; run `pip install psgc` first.")
+    data_dir = os.path.join(spec.submodule_search_locations[0], "data", "core")
+
+    def read(name):
+        with open(os.path.join(data_dir, f"{name}.json"), encoding="utf-8") as data_file:
+            return json.load(data_file)
+
+    def short_code(record):
+        return record.get("correspondence_code") or record["psgc_code"][:9]
+
+    regions = [{"code": short_code(region), "name": region["name"]} for region in read("regions")]
+    region_codes = {region["psgc_code"]: short_code(region) for region in read("regions")}
+    # Pseudo provinces group independent cities; build_snapshot re-homes those cities by code
+    real_provinces = [province for province in read("provinces") if not province.get("is_pseudo")]
+    province_codes = {province["psgc_code"]: short_code(province) for province in real_provinces}
+    provinces = [
+        {"code": short_code(province), "name": province["name"], "region_code": region_codes[province["region_code"]]}
+        for province in real_provinces
+    ]
+    cities = [
+        {
+            "code": short_code(city),
+            "name": city["name"],
+            "region_code": region_codes[city["region_code"]],
+            "province_code": province_codes.get(city["province_code"]),
+        }
+        for city in read("cities") if city["geographic_level"] in ("City", "Mun")
+    ]
+    return regions, provinces, cities, f"psgc package {_package_version('psgc')}"
+
+
+def build_snapshot(regions, provinces, cities, source, path=SNAPSHOT_PATH):
+    """Writes a sorted, indexed snapshot.
+
+    Cities without a province are placed by their PSGC code: independent cities carry
+    their geographic province in digits 3-4. NCR cities, and the few cities that
+    belong to no province at all, are listed under a region-level entry instead.
+    """
+    provinces = list(provinces)
+    province_codes = {province["code"] for province in provinces}
+    region_names = {region["code"]: region["name"] for region in regions}
+
+    placed_cities = []
+    for city in cities:
+        province_code = city["province_code"]
+        if province_code not in province_codes:
+            province_code = city["code"][:4] + "00000"
+        if city["region_code"] == NCR_REGION_CODE or province_code not in province_codes:
+            province_code = city["region_code"]
+            if province_code not in province_codes:
+                name = NCR_PROVINCE_NAME if province_code == NCR_REGION_CODE else region_names[province_code]
+                provinces.append({"code": province_code, "name": name, "region_code": province_code})
+                province_codes.add(province_code)
+        placed_cities.append((city["code"], city["name"], province_code, city["region_code"]))
+
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    with db:
+        db.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE regions (code TEXT PRIMARY KEY, name TEXT NOT NULL, position INTEGER NOT NULL);
+            CREATE TABLE provinces (code TEXT PRIMARY KEY, name TEXT NOT NULL, region_code TEXT NOT NULL, position INTEGER NOT NULL);
+            CREATE TABLE cities (code TEXT PRIMARY KEY, name TEXT NOT NULL, province_code TEXT NOT NULL, region_code TEXT NOT NULL, position INTEGER NOT NULL);
+            CREATE INDEX provinces_region ON provinces (region_code, position);
+            CREATE INDEX cities_province ON cities (province_code, position);
+        """)
+        db.executemany(
+            "INSERT INTO regions VALUES (?, ?, ?)",
+            [(region["code"], region["name"], position)
+             for position, region in enumerate(sorted(regions, key=lambda region: region["name"]))],
+        )
+        db.executemany(
+            "INSERT INTO provinces VALUES (?, ?, ?, ?)",
+            [(province["code"], province["name"], province["region_code"], position)
+             for position, province in enumerate(sorted(provinces, key=lambda province: province["name"]))],
+        )
+        db.executemany(
+            "INSERT INTO cities VALUES (?, ?, ?, ?, ?)",
+            [(*city, position) for position, city in enumerate(sorted(placed_cities, key=lambda city: city[1]))],
+        )
+        fetched_at = datetime.now(timezone.utc)
+        db.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("format_version", str(SNAPSHOT_FORMAT_VERSION)),
+            ("version", fetched_at.strftime("%Y.%m.%d")),
+            ("source", source),
+            ("fetched_at", fetched_at.isoformat(timespec="seconds")),
+        ])
+    db.execute("VACUUM")
+    db.close()
+    os.replace(tmp_path, path)
+    return len(regions), len(provinces), len(placed_cities)
+
+
+def _package_version(name):
+    from importlib.metadata import version
+    return version(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    refresh = subparsers.add_parser("refresh", help="rebuild the bundled snapshot")
+    refresh.add_argument("--source", choices=["api", "psgc-package"], default="api")
+    refresh.add_argument("--output", default=SNAPSHOT_PATH)
+    subparsers.add_parser("info", help="show the bundled snapshot's version and size")
+    args = parser.parse_args(argv)
+
+    if args.command == "refresh":
+        loaded = fetch_from_api() if args.source == "api" else fetch_from_psgc_package()
+        counts = build_snapshot(*loaded, path=args.output)
+        print("Wrote %s: %d regions, %d provinces, %d cities/municipalities" % (args.output, *counts))
+    else:
+        geography = load_geography()
+        print(json.dumps(geography.meta, indent=2))
+        print("%d regions, %d provinces, %d cities/municipalities" % (
+            len(geography.region_names), len(geography.province_names),
+            sum(len(names) for names in geography.cities_by_province.values()),
+        ))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""Shared clients for the upstream services the app calls (OpenAI, PSGC).
+
+Every call to an upstream goes through `Upstream.call`, which adds an optional
+per-process concurrency limit, retries with jittered exponential backoff, a
+circuit breaker and latency/retry metrics. The metrics are kept in `metrics`
+with an upstream= label, so they are part of the /metrics export. Clients are
+created once per process with connection pooling and explicit connect/read
+timeouts.
+"""
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Connect/read timeouts in seconds
+OPENAI_TIMEOUT = httpx.Timeout(float(os.getenv("OPENAI_READ_TIMEOUT", "60")), connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")))
+PSGC_TIMEOUT = (5, 30)
+
+# Concurrent GPT-4o vision calls allowed per process; further uploads wait their turn
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", "8"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+UPSTREAM_COUNTERS = ("calls", "successes", "failures", "retries", "short_circuited")
+CIRCUIT_STATES = ("closed", "half_open", "open")
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets one trial call through after `reset_timeout`."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError("circuit open")
+                self.state = "half_open"
+            elif self.state == "half_open":
+                # A trial call is already in flight
+                raise CircuitOpenError("circuit half-open, trial call in flight")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class Upstream:
+    """Retry, circuit breaking, concurrency limiting and metrics for one upstream service."""
+
+    def __init__(self, name, max_attempts=3, base_delay=0.5, max_delay=8.0, failure_threshold=5,
+                 reset_timeout=30.0, concurrency=None, queue_timeout=120.0):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.queue_timeout = queue_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._semaphore = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self._report_circuit()
+
+    def call(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs), retrying transient errors; the last error is re-raised."""
+        self._count("calls")
+        if self._semaphore is None:
+            return self._call_with_retries(func, args, kwargs)
+
+        metrics.add_to_gauge("upstream.queued", 1, upstream=self.name)
+        acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+        metrics.add_to_gauge("upstream.queued", -1, upstream=self.name)
+        if not acquired:
+            self._count("failures")
+            raise TimeoutError(f"Timed out waiting for a free {self.name} slot")
+        try:
+            return self._call_with_retries(func, args, kwargs)
+        finally:
+            self._semaphore.release()
+
+    def stats(self):
+        """This upstream's counters, gauges and latency, as kept in metrics."""
+        stats = {counter: metrics.counter(f"upstream.{counter}", upstream=self.name) for counter in UPSTREAM_COUNTERS}
+        for gauge in ("in_flight", "queued"):
+            stats[gauge] = metrics.gauge(f"upstream.{gauge}", upstream=self.name)
+        latency = metrics.distribution_stats("upstream.latency_seconds", upstream=self.name)
+        stats["circuit"] = self.breaker.state
+        stats["latency_p50"] = latency["p50"]
+        stats["latency_p95"] = latency["p95"]
+        stats["latency_max"] = latency["max"]
+        return stats
+
+    def _call_with_retries(self, func, args, kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self._count("short_circuited")
+                raise CircuitOpenError(f"{self.name} is unavailable; not calling it for now") from None
+            finally:
+                self._report_circuit()
+
+            metrics.add_to_gauge("upstream.in_flight", 1, upstream=self.name)
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                self._record_latency(time.perf_counter() - started)
+                retry_after = _retry_after(error)
+                if retry_after is None:
+                    # The upstream answered; it was the request that was bad
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                self._report_circuit()
+                if retry_after is None or attempt == self.max_attempts:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(max(retry_after, self._backoff(attempt)))
+            else:
+                self._record_latency(time.perf_counter() - started)
+                self.breaker.record_success()
+                self._report_circuit()
+                self._count("successes")
+                return result
+            finally:
+                metrics.add_to_gauge("upstream.in_flight", -1, upstream=self.name)
+
+    def _backoff(self, attempt):
+        # Full jitter: a random delay up to the capped exponential step
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _count(self, counter):
+        metrics.increment(f"upstream.{counter}", upstream=self.name)
+
+    def _record_latency(self, seconds):
+        metrics.observe("upstream.latency_seconds", seconds, upstream=self.name)
+
+    def _report_circuit(self):
+        # One 0/1 gauge per state, so dashboards can plot or alert on "open" directly
+        state = self.breaker.state
+        for candidate in CIRCUIT_STATES:
+            metrics.set_gauge("upstream.circuit_state", int(candidate == state), upstream=self.name, state=candidate)
+
+
+def _retry_after(error):
+    """Returns how long to wait before retrying `error`, or None if it isn't transient."""
+    response = None
+    if isinstance(error, (openai.APIConnectionError, requests.ConnectionError, requests.Timeout)):
+        return 0.0
+    if isinstance(error, openai.APIStatusError):
+        response = error.response
+    elif isinstance(error, requests.HTTPError):
+        response = error.response
+    if response is None or response.status_code not in RETRYABLE_STATUS_CODES:
+        return None
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except ValueError:
+        return 0.0
+
+
+UPSTREAMS = {
+    "openai-vision": Upstream("openai-vision", concurrency=VISION_CONCURRENCY),
+    # File uploads and batch bookkeeping for openai_batch.py; kept apart from interactive vision calls
+    "openai-batch": Upstream("openai-batch", max_attempts=4),
+    "psgc": Upstream("psgc", max_attempts=4),
+}
+
+
+def upstream(name):
+    return UPSTREAMS[name]
+
+
+def upstream_stats():
+    """Latency, retry and circuit metrics for every upstream, keyed by name."""
+    return {name: upstream.stats() for name, upstream in UPSTREAMS.items()}
+
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def openai_client():
+    """Process-wide OpenAI client with a pooled HTTP connection and explicit timeouts.
+
+    Its built-in retries are turned off; `Upstream.call` retries instead so that
+    retries are counted and respect the circuit breaker.
+    """
+    global _openai_client
+    with _openai_client_lock:
+        if _openai_client is None:
+            _openai_client = openai.OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=OPENAI_TIMEOUT,
+                max_retries=0,
+                http_client=httpx.Client(
+                    timeout=OPENAI_TIMEOUT,
+                    limits=httpx.Limits(max_connections=VISION_CONCURRENCY * 2, max_keepalive_connections=VISION_CONCURRENCY),
+                ),
+            )
+        return _openai_client
+
+
+def requests_session(pool_size=10):
+    """requests.Session with a connection pool sized for `pool_size` concurrent requests per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,184 @@
+import binascii
+import io
+import logging
+import math
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Per document type: longest edge in pixels, whether colour carries information,
+# starting JPEG quality and the byte size we try to stay under.
+PREPROCESS_SETTINGS = {
+    "ID": {"max_edge": 1600, "grayscale": False, "quality": 85, "max_bytes": 500_000},
+    "DTI": {"max_edge": 1600, "grayscale": True, "quality": 80, "max_bytes": 400_000},
+    "ITR": {"max_edge": 2048, "grayscale": True, "quality": 80, "max_bytes": 700_000},
+    "Bank_Statement": {"max_edge": 2048, "grayscale": True, "quality": 80, "max_bytes": 700_000},
+}
+DEFAULT_SETTINGS = {"max_edge": 1600, "grayscale": False, "quality": 85, "max_bytes": 500_000}
+
+# Never recompress below this quality when chasing max_bytes; text stops being legible
+MIN_QUALITY = 50
+QUALITY_STEP = 10
+
+# Input bytes base64-encoded per step when building a data URL; a multiple of 3 so chunks need no padding
+B64_CHUNK_BYTES = 3 * 64 * 1024
+
+ORIENTATION_TAG = 0x0112
+
+
+def settings_for(document_type):
+    return PREPROCESS_SETTINGS.get(document_type, DEFAULT_SETTINGS)
+
+
+class BufferReader(io.RawIOBase):
+    """Seekable read-only file object over a bytes-like object, so PIL can read an upload without a copy."""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._position + size)
+        chunk = self._view[self._position:end].tobytes()
+        self._position = max(self._position, end)
+        return chunk
+
+    def readinto(self, buffer):
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+
+def build_data_url(buffer, mime_type="image/jpeg"):
+    """Base64-encodes a buffer straight into a data URL in one pass.
+
+    The output is written chunk by chunk into a single preallocated bytearray, so
+    the only full-size allocations are that array and the final string.
+    """
+    view = memoryview(buffer).cast("B")
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+    url = bytearray(len(prefix) + 4 * math.ceil(len(view) / 3))
+    url[:len(prefix)] = prefix
+    position = len(prefix)
+    for start in range(0, len(view), B64_CHUNK_BYTES):
+        encoded = binascii.b2a_base64(view[start:start + B64_CHUNK_BYTES], newline=False)
+        url[position:position + len(encoded)] = encoded
+        position += len(encoded)
+    return url.decode("ascii")
+
+
+def preprocess_image(image_bytes, document_type):
+    """Prepares an upload for a vision call: fixes orientation, drops alpha, downsizes and recompresses.
+
+    `image_bytes` can be any bytes-like object, such as the memoryview returned by
+    `UploadedFile.getbuffer()`; it is read in place, never copied. A JPEG that is
+    already upright, small enough and under the size target is passed through as is.
+    Otherwise the image is decoded once (JPEGs straight at a reduced scale where
+    possible), converted and resized in place, then encoded. It is only re-encoded
+    if the first pass lands above the size target. Returns a buffer of JPEG bytes
+    and a dict of stats including how many bytes were saved.
+    """
+    settings = settings_for(document_type)
+    max_edge = settings["max_edge"]
+    target_mode = "L" if settings["grayscale"] else "RGB"
+    original_bytes = memoryview(image_bytes).nbytes
+
+    image = Image.open(BufferReader(image_bytes))
+    original_size = image.size
+
+    if _is_acceptable_jpeg(image, original_bytes, settings, target_mode):
+        logger.info("Passing %s through unchanged: %d bytes, %sx%s", document_type, original_bytes, *original_size)
+        return image_bytes, {
+            "document_type": document_type,
+            "original_bytes": original_bytes,
+            "processed_bytes": original_bytes,
+            "bytes_saved": 0,
+            "original_size": original_size,
+            "processed_size": original_size,
+            "quality": None,
+        }
+
+    # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of decoding full size and shrinking
+    scale = max_edge / max(image.size)
+    if image.format == "JPEG" and scale < 1:
+        image.draft(target_mode, (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+
+    ImageOps.exif_transpose(image, in_place=True)
+    image = _convert_mode(image, target_mode)
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    quality = settings["quality"]
+    output = _encode_jpeg(image, quality)
+    while output.getbuffer().nbytes > settings["max_bytes"] and quality - QUALITY_STEP >= MIN_QUALITY:
+        quality -= QUALITY_STEP
+        # Free the rejected encode first so two full JPEGs are never held at once
+        output.close()
+        output = _encode_jpeg(image, quality)
+
+    # A view over the BytesIO's own storage rather than a getvalue() copy
+    processed = output.getbuffer()
+    stats = {
+        "document_type": document_type,
+        "original_bytes": original_bytes,
+        "processed_bytes": processed.nbytes,
+        "bytes_saved": original_bytes - processed.nbytes,
+        "original_size": original_size,
+        "processed_size": image.size,
+        "quality": quality,
+    }
+    logger.info(
+        "Preprocessed %s: %d -> %d bytes (%d saved), %sx%s -> %sx%s at quality %d",
+        document_type, stats["original_bytes"], stats["processed_bytes"], stats["bytes_saved"],
+        *original_size, *image.size, quality,
+    )
+    return processed, stats
+
+
+def _is_acceptable_jpeg(image, size_in_bytes, settings, target_mode):
+    return (
+        image.format == "JPEG"
+        and image.mode == target_mode
+        and max(image.size) <= settings["max_edge"]
+        and size_in_bytes <= settings["max_bytes"]
+        and image.getexif().get(ORIENTATION_TAG, 1) == 1
+    )
+
+
+def _convert_mode(image, target_mode):
+    if image.mode == "P":
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    if image.mode in ("RGBA", "LA"):
+        # JPEG has no alpha channel; flatten onto white the way the document would look on paper
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    if image.mode != target_mode:
+        image = image.convert(target_mode)
+    return image
+
+
+def _encode_jpeg(image, quality):
+    output = BytesIO()
+    # No optimize=True: it makes Pillow allocate a width x height scratch buffer per encode
+    image.save(output, format="JPEG", quality=quality)
+    return output
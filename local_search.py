@@ -0,0 +1,257 @@
+"""In-process hybrid search index that can stand in for the Pinecone index.
+
+The loan knowledge base is a few hundred chunks, so it fits in a NumPy matrix
+and searching it locally avoids a network round-trip per question (and lets the
+chatbot run without Pinecone at all). `LocalHybridIndex.query` takes the same
+arguments and returns the same shape as `pinecone.Index.query`, so the existing
+hybrid retriever works on it unchanged: the retriever weights the dense and
+sparse query vectors by alpha, and the index scores each chunk by dot product
+with both, exactly as a Pinecone dotproduct index does.
+
+Set RETRIEVAL_BACKEND=local to use it. To build the index file:
+
+    python local_search.py build --from-pinecone          # copy the vectors already in Pinecone
+    python local_search.py build --documents DIR          # embed .txt/.md files in DIR
+    python local_search.py bench                          # query latency on the built index
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "knowledge_base.npz")
+TEXT_KEY = "context"
+# Approximate dense search only pays off on much bigger corpora than ours
+ANN_MIN_DOCUMENTS = 5000
+ANN_CANDIDATES_PER_RESULT = 10
+
+
+class LocalHybridIndex:
+    def __init__(self, ids, dense, sparse_indptr, sparse_indices, sparse_values, metadata, ann=None):
+        self.ids = list(ids)
+        self.dense = np.ascontiguousarray(dense, dtype=np.float32)
+        self.metadata = list(metadata)
+        self.sparse_indptr = np.asarray(sparse_indptr, dtype=np.int64)
+        self.sparse_indices = np.asarray(sparse_indices, dtype=np.int64)
+        self.sparse_values = np.asarray(sparse_values, dtype=np.float32)
+
+        # Invert the per-document sparse vectors into postings lists: for each
+        # term, the documents it appears in and its weight there
+        documents = np.repeat(np.arange(len(self.ids)), np.diff(self.sparse_indptr))
+        order = np.argsort(self.sparse_indices, kind="stable")
+        self._posting_documents = documents[order]
+        self._posting_values = self.sparse_values[order]
+        terms = self.sparse_indices[order]
+        self._terms, self._term_starts = np.unique(terms, return_index=True)
+        self._term_ends = np.append(self._term_starts[1:], len(terms))
+
+        self._ann = None
+        if ann == "hnsw" or (ann == "auto" and len(self.ids) >= ANN_MIN_DOCUMENTS):
+            self._ann = _build_hnsw(self.dense)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def query(self, vector, sparse_vector=None, top_k=4, include_metadata=True, namespace=None, **kwargs):
+        """Pinecone-compatible query; namespace is accepted and ignored."""
+        query_vector = np.asarray(vector, dtype=np.float32)
+        if self._ann is not None:
+            candidates = self._ann_candidates(query_vector, top_k)
+            sparse_scores = self._sparse_scores(sparse_vector)
+            candidates = np.union1d(candidates, np.flatnonzero(sparse_scores))
+            scores = self.dense[candidates] @ query_vector + sparse_scores[candidates]
+        else:
+            candidates = None
+            scores = self.dense @ query_vector + self._sparse_scores(sparse_vector)
+
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return {"matches": []}
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        matches = []
+        for position in best:
+            document = int(candidates[position]) if candidates is not None else int(position)
+            match = {"id": self.ids[document], "score": float(scores[position])}
+            if include_metadata:
+                match["metadata"] = dict(self.metadata[document])
+            matches.append(match)
+        return {"matches": matches}
+
+    def _sparse_scores(self, sparse_vector):
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        if not sparse_vector or not len(self._terms):
+            return scores
+        terms = np.asarray(sparse_vector["indices"], dtype=np.int64)
+        weights = np.asarray(sparse_vector["values"], dtype=np.float32)
+        positions = np.minimum(np.searchsorted(self._terms, terms), len(self._terms) - 1)
+        known = self._terms[positions] == terms
+        for position, weight in zip(positions[known], weights[known]):
+            start, end = self._term_starts[position], self._term_ends[position]
+            # Postings hold each document at most once per term
+            scores[self._posting_documents[start:end]] += weight * self._posting_values[start:end]
+        return scores
+
+    def _ann_candidates(self, query_vector, top_k):
+        k = min(len(self.ids), top_k * ANN_CANDIDATES_PER_RESULT)
+        labels, _ = self._ann.knn_query(query_vector, k=k)
+        return labels[0].astype(np.int64)
+
+    def save(self, path=INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            dense=self.dense,
+            sparse_indptr=self.sparse_indptr,
+            sparse_indices=self.sparse_indices,
+            sparse_values=self.sparse_values,
+            ids=np.array(json.dumps(self.ids)),
+            metadata=np.array(json.dumps(self.metadata)),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH, ann=None):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                ids=json.loads(str(data["ids"])),
+                dense=data["dense"],
+                sparse_indptr=data["sparse_indptr"],
+                sparse_indices=data["sparse_indices"],
+                sparse_values=data["sparse_values"],
+                metadata=json.loads(str(data["metadata"])),
+                ann=ann,
+            )
+
+    @classmethod
+    def from_records(cls, records, ann=None):
+        """Builds the index from (id, dense, sparse, metadata) tuples, sparse as {"indices", "values"}."""
+        ids, dense, metadata = [], [], []
+        indptr, indices, values = [0], [], []
+        for record_id, vector, sparse, record_metadata in records:
+            ids.append(record_id)
+            dense.append(vector)
+            metadata.append(record_metadata)
+            sparse = sparse or {"indices": [], "values": []}
+            indices.extend(sparse["indices"])
+            values.extend(sparse["values"])
+            indptr.append(len(indices))
+        return cls(ids, np.array(dense, dtype=np.float32), indptr, indices, values, metadata, ann=ann)
+
+
+def _build_hnsw(dense):
+    try:
+        import hnswlib
+    except ImportError:
+        return None
+    ann = hnswlib.Index(space="ip", dim=dense.shape[1])
+    ann.init_index(max_elements=len(dense), ef_construction=200, M=16)
+    ann.add_items(dense, np.arange(len(dense)))
+    ann.set_ef(64)
+    return ann
+
+
+def load_index(path=None):
+    """Loads the index file named by LOCAL_INDEX_PATH; LOCAL_INDEX_ANN picks the dense search (auto|hnsw|exact)."""
+    return LocalHybridIndex.load(path or os.getenv("LOCAL_INDEX_PATH", INDEX_PATH), ann=os.getenv("LOCAL_INDEX_ANN", "auto"))
+
+
+def records_from_pinecone(index, namespace=""):
+    """Yields every vector stored in a Pinecone index, ready for LocalHybridIndex.from_records."""
+    for ids in index.list(namespace=namespace):
+        fetched = index.fetch(ids=list(ids), namespace=namespace)
+        for record_id in ids:
+            vector = fetched.vectors[record_id]
+            sparse = vector.sparse_values
+            yield (
+                record_id,
+                vector.values,
+                {"indices": list(sparse.indices), "values": list(sparse.values)} if sparse else None,
+                dict(vector.metadata or {}),
+            )
+
+
+def load_documents(directory, chunk_chars=1000):
+    """Splits every .txt/.md file in a directory into paragraph-aligned chunks of about chunk_chars."""
+    chunks = []
+    for path in sorted(Path(directory).rglob("*")):
+        if path.suffix.lower() not in (".txt", ".md"):
+            continue
+        paragraphs = [paragraph.strip() for paragraph in path.read_text(encoding="utf-8").split("\n\n")]
+        current = ""
+        for paragraph in filter(None, paragraphs):
+            if current and len(current) + len(paragraph) > chunk_chars:
+                chunks.append((path.name, current))
+                current = ""
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+        if current:
+            chunks.append((path.name, current))
+    return chunks
+
+
+def records_from_documents(chunks, embeddings, sparse_encoder):
+    texts = [text for _, text in chunks]
+    dense = embeddings.embed_documents(texts)
+    sparse = sparse_encoder.encode_documents(texts)
+    for number, ((source, text), vector, sparse_vector) in enumerate(zip(chunks, dense, sparse)):
+        yield f"{source}#{number}", vector, sparse_vector, {TEXT_KEY: text, "source": source}
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="build the local index file")
+    source = build.add_mutually_exclusive_group(required=True)
+    source.add_argument("--from-pinecone", action="store_true", help="copy vectors from PINECONE_INDEX_NAME")
+    source.add_argument("--documents", help="directory of .txt/.md knowledge-base files to embed")
+    build.add_argument("--namespace", default="")
+    build.add_argument("--output", default=INDEX_PATH)
+    bench = subparsers.add_parser("bench", help="time queries against the index file")
+    bench.add_argument("--path", default=INDEX_PATH)
+    bench.add_argument("--queries", type=int, default=1000)
+    bench.add_argument("--top-k", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        if args.from_pinecone:
+            from pinecone import Pinecone
+
+            pinecone_index = Pinecone(api_key=os.getenv("PINECONE_API_KEY")).Index(os.getenv("PINECONE_INDEX_NAME"))
+            records = records_from_pinecone(pinecone_index, args.namespace)
+        else:
+            from bm25_model import load_encoder
+            from embedding_store import shared_embeddings
+
+            records = records_from_documents(
+                load_documents(args.documents), shared_embeddings("text-embedding-3-large"), load_encoder()
+            )
+        index = LocalHybridIndex.from_records(records)
+        index.save(args.output)
+        print("Wrote %s: %d chunks, %d dimensions" % (args.output, len(index), index.dense.shape[1]))
+    else:
+        index = LocalHybridIndex.load(args.path)
+        rng = np.random.default_rng(0)
+        rows = rng.integers(0, len(index), size=args.queries)
+        timings = []
+        for row in rows:
+            start, end = index.sparse_indptr[row], index.sparse_indptr[row + 1]
+            sparse_vector = {"indices": index.sparse_indices[start:end], "values": index.sparse_values[start:end]}
+            started = time.perf_counter()
+            index.query(index.dense[row], sparse_vector, top_k=args.top_k)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        print("%d chunks: p50 %.3fms, p95 %.3fms, max %.3fms" % (
+            len(index), timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.95)] * 1000, timings[-1] * 1000,
+        ))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
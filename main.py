@@ -1,22 +1,18 @@
 from datetime import datetime
-import json
-import openai
 from altair import value
 from dotenv import load_dotenv
-from PIL import Image
-from io import BytesIO
 import streamlit as st
-import os
-import base64
-import io
-import requests
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from extraction import DOCUMENT_LABELS, extract_documents
+from geography import load_geography
+from profile_store import create_profile_store
+import tracing
 load_dotenv()
 
-st.set_page_config(layout='wide')
+# /metrics and /traces for this process when METRICS_PORT is set (see tracing.py)
+tracing.start_metrics_server()
 
-client = openai.OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-)
+st.set_page_config(layout='wide')
 
 if 'show_eligibility_checker' not in st.session_state:
     st.session_state.show_eligibility_checker = False
@@ -30,154 +26,33 @@ if "show_loan_application_form" not in st.session_state:
 if "show_loan_application_results" not in st.session_state:
     st.session_state.show_loan_application_results = False
 
+if "home" not in st.session_state:
+    st.session_state.home = True
+
+
+# One store per process; each browser session only ever sees its own profile
+@st.cache_resource(show_spinner=False)
+def get_profile_store():
+    return create_profile_store()
+
+def current_session_id():
+    return get_script_run_ctx().session_id
+
+# Text widgets only accept strings, whatever type the profile holds a field in
+def profile_text(data, field):
+    value = data.get(field)
+    return "" if value is None else str(value)
+
+NONE_SELECTED = "--none selected--"
 
-# Fetch data from APi
-@st.cache_data(show_spinner=False)
-def fetch_data():
-    provinces_api_url = "https://psgc.gitlab.io/api/regions/"
-    provinces = requests.get(provinces_api_url)
-    provinces.raise_for_status()
-
-    cities_api_url = "https://psgc.gitlab.io/api/regions/130000000/cities/"
-    cities = requests.get(cities_api_url)
-    cities.raise_for_status()
-
-    return provinces.json(), cities.json()
-
-def encode_image(image_bytes):
-    return base64.b64encode(image_bytes).decode("utf-8")
-
-def extract_raw_text_from_img_openai_all(image_bytes, document_type, has_middle_name):
-    """Extracts text from the image using GPT-4o (OpenAI Vision) with structured extraction instructions."""
-    image = Image.open(io.BytesIO(image_bytes))
-
-    buffered = BytesIO()
-    image.save(buffered, format="JPEG")
-    encoded_image = encode_image(buffered.getvalue())
-
-    # Adjust prompt based on document type
-    middle_name_instructions = {
-        True: (
-                "- Middle Name: If the name format is 'Last, First Middle' and the middle name checkbox is ticked, "
-                "treat the last word after the first name as the middle name. Do not skip the middle name unless it is clearly missing. "
-                "For example, if the name is 'PAMONAG, JAPHET VANCE MACESAR', extract 'JAPHET VANCE' as First Name, 'MACESAR' as Middle Name, and 'PAMONAG' as Last Name."),
-        False: (
-                "- Middle Name: If the middle name checkbox is not ticked, classify everything after the last name as part of the first name. "
-                "Do not extract a middle name; return **Not Found** for the middle name field.")
-    }
-
-    document_type_instructions = {
-        "ID": (f"""You are receiving an image of a government-issued primary ID from the Philippines. The ID will contain the following fields, which you should extract with precision:
-                    - First Name (labeled as 'Pangalan' or 'Given Names')
-                    {middle_name_instructions}
-                    - Last Name (labeled as 'Apelyido' or 'Surname')
-                    - Birth Date (labeled as 'Petsa ng kapanganakan' or 'Date of birth' use this format 'YYYY-MM-DD')
-
-                    When the format is "Last, First Middle":
-                    - If the middle name checkbox is ticked, treat the last word after the first name as the middle name. Do not skip the middle name unless it is clearly missing.
-                    - If the middle name checkbox is not ticked, classify everything after the last name as part of the first name, and do not extract a middle name. Return **Not Found** for the middle name field.
-
-                    Example of expected output:
-                    First Name: <Extracted First Name>
-                    Middle Name: <Extracted Middle Name or 'Not Found'>
-                    Last Name: <Extracted Last Name>
-                    Birth Date: <Extracted Birth Date or 'Not Found'>"""),
-
-        "DTI": (f"""You are receiving an image of a Department of Trade and Industry (DTI) Certificate from the Philippines. The certificate will contain the following fields, which you should extract with precision:
-                    - Business Name (labeled as 'Business Name')
-                    - Business Owner (labeled as 'Issued to')
-                    - Business Expiry Date (labeled as 'valid from')
-
-                    Example of expected output:
-                    Business Name: <Extracted Business Name>
-                    Business Owner: <Extracted Business Owner>
-                    Business Expiry Date: <Extracted Business Expiry Date>"""),
-
-        "ITR": (f"""You are receiving an image of an Income Tax Return (ITR) from the Philippines. The ITR will contain the following fields, which you should extract with precision:
-                    - Taxpayer Name (labeled as 'Taxpayer Name')
-                    - Taxpayer TIN (labeled as 'Taxpayer TIN' or 'TIN')
-                    - Taxpayer Address (labeled as 'Taxpayer Address' or 'Registered Address')
-                    - RDO Code (labeled as 'RDO Code')
-                    - Zip Code (labeled as 'Zip Code' containing 3 digits for example '000')
-                    - Date of Birth (labeled as 'Date of Birth')
-                    - Telephone Number (labeled as 'Telephone Number')
-                    - Line of Business (labeled as 'Line of Business')
-                    - Method of Deduction (labeled as 'Method of Deduction' options are 'Itemized Deduction' or 'Optional Standard Deduction' marked with an x)
-                    - Revenue (labeled as 'Sales/Revenues/Receipts/Fees' or '26A)
-                    - Total Revenue (labeled as 'Total' or '28A')
-                    - Gross Income (labeled as 'Gross Income from Operation' or '32A')
-                    - Total Deductions (labeled as 'Total Deductions' or '33A')
-                    - Taxable Income (labeled as 'Taxable Income' or '34A')
-                    - Taxable Income to Date (labeled as 'Taxable Income to Date' or '36A')
-                    - Total Tax Due (labeled as 'Total Tax Due' or '37A')
-                    - Tax Payment (labeled as 'Tax Payment' or '39A')
-                    - Total Amount Payable (labeled as 'Total Amount Payable' or '41A')
-
-
-                    Example of expected output:
-                    Taxpayer Name: <Extracted Taxpayer Name>
-                    Taxpayer TIN: <Extracted Taxpayer TIN>
-                    Taxpayer Address: <Extracted Taxpayer Address>
-                    RDO Code: <Extracted RDO Code>
-                    Zip Code: <Extracted Zip Code>
-                    Date of Birth: <Extracted Date of Birth>
-                    Telephone Number: <Extracted Telephone Number>
-                    Line of Business: <Extracted Line of Business>
-                    Method of Deduction: <Extracted Method of Deduction>
-                    Revenue: <Extracted Revenue>
-                    Total Revenue: <Extracted Total Revenue>
-                    Gross Income: <Extracted Gross Income>
-                    Total Deductions: <Extracted Total Deductions>
-                    Taxable Income: <Extracted Taxable Income>
-                    Taxable Income to Date: <Extracted Taxable Income to Date>
-                    Total Tax Due: <Extracted Total Tax Due>
-                    Tax Payment: <Extracted Tax Payment>
-                    Total Amount Payable: <Extracted Total Amount Payable>"""),
-
-        "Bank_Statement": (f"""You are receiving an image of a Bank Statement from the Philippines. The Bank Statement will contain the following fields, which you should extract with precision:
-                    - Bank Name (labeled as 'Bank Name' and usually located at the top of the statement)
-                    - Bank Branch (labeled as 'Branch' or 'Branch Name' and usually located below the Bank Name)
-                    - Account Holder Name (labeled as 'Account Name' or 'Account Holder Name')
-                    - Account Holder Address (labeled as 'Account Address' or 'Account Holder Address')
-                    - Account Number (labeled as 'Primary Account Number')
-                    - Account Type (labeled as 'Account Type' or 'Type of Account')
-                    - Statement Date (labeled as 'Statement Date' or 'Date')
-                    - Other Account Type (labeled as 'Deposits & Other Credits' or 'Description')
-                    - Other Account Date Credited (labeled as 'Date Credited' or 'Date')
-
-
-                    Example of expected output:
-                    Bank Name: <Extracted Bank Name>
-                    Bank Branch: <Extracted Bank Branch>
-                    Account Holder Name: <Extracted Account Holder Name>
-                    Account Holder Address: <Extracted Account Holder Address>
-                    Account Number: <Extracted Account Number>
-                    Account Type: <Extracted Account Type>
-                    Statement Date: <Extracted Statement Date>
-                    Other Account Type: <Extracted Other Account Type>
-                    Other Account Date Credited: <Extracted Other Account Date Credited>""")
-
-    }
-
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": f"""
-                    {document_type_instructions.get(document_type, "Invalid document type. Please provide a valid document type.")}
-                    Please output only the extracted text, no need for explanations or other conversational responses.
-                    """.strip()},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}}
-                ]
-            }
-        ],
-        max_tokens=2048
-    )
-
-    raw_text = response.choices[0].message.content
-    return raw_text
+# Address selector options from the bundled PSGC snapshot, built once per process
+@st.cache_resource(show_spinner=False)
+def address_options():
+    with tracing.span("geography.address_options"):
+        geography = load_geography()
+        provinces = (NONE_SELECTED,) + geography.province_names
+        cities = {province: (NONE_SELECTED,) + geography.cities_in(province) for province in geography.province_names}
+        return provinces, cities
 
 @st.dialog("❗Important Reminder",width="large")
 def dialog():
@@ -200,42 +75,38 @@ def dialog():
 
 
 def eligibility_checker_form():
-    fetch_data()
-    provinces, cities = fetch_data()
+    provinces_names, cities_by_province = address_options()
 
     if "show_form" not in st.session_state:
         st.session_state.show_form = False
 
-    provinces_names = ["--none selected--"] + sorted([province["name"] for province in provinces])
-    cities_names = ["--none selected--"] + sorted([city["name"] for city in cities])
-
-    with open('extracted_data.json', 'r') as json_file:
-        data = json.load(json_file)
+    data = get_profile_store().get(current_session_id())
 
     if st.session_state.show_form:
         col1, col2, col3 = st.columns([1, 3, 1])
         with col2:
             st.markdown("<h2 style='text-align: center; color: black;'>BPI SME Loan Eligibility Checker</h2>",
                         unsafe_allow_html=True)
+            # Outside the form so choosing a province reruns the script and narrows the city list
+            province = st.selectbox("Business Address - Province", provinces_names)
+            city = st.selectbox("Business Address - City", cities_by_province.get(province, (NONE_SELECTED,)))
             with st.form("eligibility_form"):
                 col1, col2, col3 = st.columns(3)
                 with col1:
-                    first_name = st.text_input("First Name", value=data.get("First Name", ""))
+                    first_name = st.text_input("First Name", value=profile_text(data, "First Name"))
                 with col2:
-                    middle_name = st.text_input("Middle Name", value=data.get("Middle Name", ""))
+                    middle_name = st.text_input("Middle Name", value=profile_text(data, "Middle Name"))
                 with col3:
-                    last_name = st.text_input("Last Name", value=data.get("Last Name", ""))
-                email_address = st.text_input("Email Address", value=data.get("Email", ""))
-                province = st.selectbox("Business Address - Province", provinces_names, index=13)
-                city = st.selectbox("Business Address - City", cities_names, index=13)
-                date_of_birth_str = data.get("Birth Date", "")
-                if date_of_birth_str:
-                    date_of_birth = datetime.strptime(date_of_birth_str, "%Y-%m-%d")
-                else:
+                    last_name = st.text_input("Last Name", value=profile_text(data, "Last Name"))
+                email_address = st.text_input("Email Address", value=profile_text(data, "Email"))
+                # Dates the normalizer couldn't parse stay as raw text; leave those for manual entry
+                try:
+                    date_of_birth = datetime.strptime(data.get("Birth Date") or "", "%Y-%m-%d")
+                except ValueError:
                     date_of_birth = None
                 date_of_birth = st.date_input("Date of Birth", value=date_of_birth)
                 contact_method = st.radio("Preferred Contact Method", ["Landline Number", "Mobile Number"])
-                contact_number = st.text_input("Contact Number", value=data.get("Telephone Number", ""))
+                contact_number = st.text_input("Contact Number", value=profile_text(data, "Telephone Number"))
                 st.write("---")
                 existing_depositor = st.radio("Are you an existing depositor of BPI?", ["Yes", "No"])
                 how_did_you_find_out = st.text_input("How did you find out about BPI Ka-Negosyo Loans?")
@@ -255,8 +126,8 @@ def eligibility_checker_form():
                                          ["Individual", "Sole Proprietorship", "Professional Engaging in Business",
                                           "One Person Corporation", "Partnership/Corporation"])
                 years_in_business = st.text_input("How many years has your company been in business?")
-                business_industry = st.text_input("What industry does your business belong to?", value=data.get("Line of Business", ""))
-                gross_monthly_income = st.text_input("What is your company's total gross monthly income?", value=data.get("Gross Income", ""))
+                business_industry = st.text_input("What industry does your business belong to?", value=profile_text(data, "Line of Business"))
+                gross_monthly_income = st.text_input("What is your company's total gross monthly income?", value=profile_text(data, "Gross Income"))
                 loan_timeline = st.selectbox("How soon would your company require the loan?",
                                              ["--none selected--", "Within a month", "In 1-3 months", "3-6 months",
                                               "More than 6 months", "Not yet confirmed"])
@@ -267,7 +138,7 @@ def eligibility_checker_form():
                 with col1:
                     cancel = st.form_submit_button("Cancel", use_container_width=True, type="secondary")
                 if submitted:
-                    if not all([first_name, middle_name, last_name, email_address, province != "--none selected--", city != "--none selected--",
+                    if not all([first_name, middle_name, last_name, email_address, province != NONE_SELECTED, city != NONE_SELECTED,
                                 date_of_birth, contact_number, how_did_you_find_out, loan_purpose != "--none selected--",
                                 loan_amount, loan_type != "--none selected--", years_in_business, business_industry,
                                 gross_monthly_income, loan_timeline != "--none selected--"]):
@@ -326,65 +197,45 @@ def eligibility_checker_form():
             itr_upload = st.file_uploader("Upload ITR here", type=["jpg", "jpeg", "png"])
             bank_statement_upload = st.file_uploader("Upload Bank Statement here", type=["jpg", "jpeg", "png"])
 
-        if id_upload:
-            image_bytes = id_upload.getbuffer()
-            output = extract_raw_text_from_img_openai_all(image_bytes, "ID", has_middle_name=True)
-            lines = output.splitlines()
-            info_dict = {}
-
-            for line in lines:
-                key, value = line.split(": ")
-                info_dict[key] = value
-
-            data.update(info_dict)
-            # Write the dictionary to a JSON file
-            with open('extracted_data.json', 'w') as json_file:
-                json.dump(data, json_file, indent=4)
-
-        if dti_upload:
-            image_bytes = dti_upload.getbuffer()
-            output = extract_raw_text_from_img_openai_all(image_bytes, "DTI", has_middle_name=False)
-            lines = output.splitlines()
-            info_dict = {}
-
-            for line in lines:
-                key, value = line.split(": ")
-                info_dict[key] = value
-
-            data.update(info_dict)
-            # Write the dictionary to a JSON file
-            with open('extracted_data.json', 'w') as json_file:
-                json.dump(data, json_file, indent=4)
-
-        if itr_upload:
-            image_bytes = itr_upload.getbuffer()
-            output = extract_raw_text_from_img_openai_all(image_bytes, "ITR", has_middle_name=False)
-            lines = output.splitlines()
-            info_dict = {}
-
-            for line in lines:
-                key, value = line.split(": ")
-                info_dict[key] = value
-
-            data.update(info_dict)
-            # Write the dictionary to a JSON file
-            with open('extracted_data.json', 'w') as json_file:
-                json.dump(data, json_file, indent=4)
-
-        if bank_statement_upload:
-            image_bytes = bank_statement_upload.getbuffer()
-            output = extract_raw_text_from_img_openai_all(image_bytes, "Bank_Statement", has_middle_name=False)
-            lines = output.splitlines()
-            info_dict = {}
-
-            for line in lines:
-                key, value = line.split(": ")
-                info_dict[key] = value
-
-            data.update(info_dict)
-            # Write the dictionary to a JSON file
-            with open('extracted_data.json', 'w') as json_file:
-                json.dump(data, json_file, indent=4)
+        uploads = {
+            "ID": id_upload,
+            "DTI": dti_upload,
+            "ITR": itr_upload,
+            "Bank_Statement": bank_statement_upload,
+        }
+        # Uploads stay in their widgets across reruns, so only ones not read yet are sent
+        processed_uploads = st.session_state.setdefault("processed_uploads", {})
+        new_uploads = {
+            document_type: upload for document_type, upload in uploads.items()
+            if upload and processed_uploads.get(document_type) != upload.file_id
+        }
+        pending = [
+            (document_type, upload.getbuffer(), document_type == "ID")
+            for document_type, upload in new_uploads.items()
+        ]
+
+        if pending:
+            progress = st.progress(0.0, text="Reading your documents...")
+            results = {}
+            with tracing.span("extraction.upload_set", documents=len(pending)) as upload_set:
+                for done, (document_type, info_dict, error) in enumerate(extract_documents(pending), start=1):
+                    if error:
+                        upload_set.add("errors", 1)
+                        st.error(f"We couldn't read your {DOCUMENT_LABELS[document_type]}. Please try uploading it again.")
+                    results[document_type] = info_dict
+                    progress.progress(done / len(pending), text=f"{DOCUMENT_LABELS[document_type]} done ({done}/{len(pending)})")
+                progress.empty()
+
+                # Merge in upload order so overlapping fields resolve the same way every time
+                extracted = {}
+                for document_type, _, _ in pending:
+                    extracted.update(results[document_type])
+                with tracing.span("profile.update", fields=len(extracted)):
+                    get_profile_store().update(current_session_id(), extracted)
+                st.session_state.pop("loan_form_defaults", None)
+            # Failed documents count as processed too; uploading the file again retries it
+            for document_type, upload in new_uploads.items():
+                processed_uploads[document_type] = upload.file_id
 
         st.divider()
 
@@ -435,242 +286,284 @@ def eligibility_results():
     </div>
     """, unsafe_allow_html=True)
 
-def loan_application_form():
-    with open('extracted_data.json', 'r') as json_file:
-        data = json.load(json_file)
+# Prefill values for the loan application form, worked out from the extracted
+# profile once per session instead of on every rerun. Cleared when new
+# documents are extracted (see eligibility_checker_form). The values are
+# written straight into the widgets' "loan_form_<field>" keys: once a key
+# exists Streamlit ignores a widget's value=, so rebuilt prefill has to
+# overwrite what the fields hold.
+def prefill_loan_form():
+    rebuilt = "loan_form_defaults" not in st.session_state
+    if rebuilt:
+        data = get_profile_store().get(current_session_id())
+        try:
+            birth_date = datetime.strptime(data.get("Birth Date") or "", "%Y-%m-%d").date()
+        except ValueError:
+            birth_date = None
+        st.session_state.loan_form_defaults = {
+            "loan_form_full_name": " ".join(filter(None, (profile_text(data, part) for part in ("First Name", "Middle Name", "Last Name")))),
+            "loan_form_birth_date": birth_date,
+            "loan_form_place_of_birth": profile_text(data, "Place of Birth"),
+            "loan_form_home_address": profile_text(data, "Taxpayer Address"),
+            "loan_form_telephone_number": profile_text(data, "Telephone Number"),
+            "loan_form_email_address": profile_text(data, "Email"),
+            "loan_form_tin": profile_text(data, "Taxpayer TIN"),
+            "loan_form_business_name": profile_text(data, "Business Name"),
+            "loan_form_nature_of_business": profile_text(data, "Line of Business"),
+            "loan_form_annual_sales_revenue": profile_text(data, "Total Revenue"),
+            "loan_form_deposit_name": profile_text(data, "Bank Name"),
+            "loan_form_credit_name": profile_text(data, "Bank Name"),
+        }
+    # Streamlit drops a widget's key after a run that doesn't render it, so
+    # coming back to the form restores the prefill for those fields
+    for key, value in st.session_state.loan_form_defaults.items():
+        if rebuilt or key not in st.session_state:
+            st.session_state[key] = value
+
+# Each section of the loan application form is a fragment: changing a field
+# reruns only its own section, not the other two or the rest of the page.
+# Values live in session_state under "loan_form_<field>" keys.
+@st.fragment
+def borrower_and_business_section():
+    with tracing.span("loan_form.section_a"):
+        col1, col2 = st.columns(2)
+        with col1:
+            st.radio("Loan Type", ["New Application", "Renewal", "Additional Loan", "Restructuring"], index=None, key="loan_form_application_type")
+        with col2:
+            st.radio("In case of loan renewal or restructuring, are there any update from the previous application?", ["Yes", "No"], index=None, key="loan_form_previous_application")
+        st.radio("Business Type", ["Individual", "Sole Proprietorship"], index=None, key="loan_form_business_type")
+        st.markdown("---")
+        st.markdown("### **A. BORROWER AND BUSINESS INFORMATION**")
+        st.markdown("---")
+        st.text_input("Name of the Borrower", key="loan_form_full_name")
+        col1, col2, col3, col4, col5 = st.columns(5)
+        with col1:
+            st.radio("Civil Status", ["Single", "Married", "Widowed", "Separated", "Annuled"], index=0, key="loan_form_civil_status")
+        with col2:
+            st.date_input("Birth Date", key="loan_form_birth_date")
+        with col3:
+            st.text_input("Place of Birth", key="loan_form_place_of_birth")
+        with col4:
+            st.text_input("Citizenship", value="Filipino", key="loan_form_citizenship")
+        with col5:
+            st.radio("Sex", ["Male", "Female"], index=0, key="loan_form_sex")
 
-    if 'show_application_form' not in st.session_state:
-        st.session_state.show_application_form = True
-        st.markdown("<h2 style='text-align: center; color: black;'>Business Loan Application Form</h2>", unsafe_allow_html=True)
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.text_input("Spouse Name", key="loan_form_spouse_name")
+        with col2:
+            st.date_input("Spouse Birth Date", value=None, key="loan_form_spouse_birth_date")
+        st.text_input("Home Address", key="loan_form_home_address")
+        col1, col2, col3 = st.columns([2,1,1])
+        with col1:
+            st.radio("Home Address Ownership", ["Owned (unencumbered)", "Owned (mortgaged)", "Rented", "Living with Relatives"], index=2, key="loan_form_home_ownership")
+        with col2:
+            st.text_input("Years of Stay", value="20", key="loan_form_years_of_stay")
+        with col3:
+            st.text_input("Telephone Number", key="loan_form_telephone_number")
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            st.text_input("Mobile Number", value="09471234567", key="loan_form_mobile_number")
+        with col2:
+            st.text_input("Email Address", key="loan_form_email_address")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.text_input("TIN", key="loan_form_tin")
+        with col2:
+            st.text_input("PhilSys ID", value="101821186", key="loan_form_philsys_id")
+        with col3:
+            st.text_input("Other Government-Issued ID", key="loan_form_other_id")
+        st.text_input("Mother's Maiden Name", value="GHA-GHA BORRES", key="loan_form_mothers_maiden_name")
+        col1, col2, col3 = st.columns([3, 1, 1])
+        with col1:
+            st.text_input("Registered Business Name", key="loan_form_business_name")
+        with col2:
+            st.text_input("Years in Operation", value="3", key="loan_form_years_of_business")
+        with col3:
+            st.text_input("Number of Branches", key="loan_form_num_of_branches")
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.radio("Is the Business Address similar to Home Address?", ["Yes", "No"], index=0, key="loan_form_similar_to_home_address")
+            st.text_input("Principal Business Address", key="loan_form_principal_business_address")
+        with col2:
+            st.radio("Business Address Ownership", ["Owned (unencumbered)", "Owned (mortgaged)", "Rented"], index=None, key="loan_form_business_address_ownership")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.text_input("Website/social media page", value="intelligent-ai.solutions", key="loan_form_website")
+        with col2:
+            st.radio("Indicate weather the business has", ["Female Manager", "Female head officer of operations"], index=None, key="loan_form_indicate_business_has")
+        col1, col2 = st.columns([1,2])
+        with col1:
+            st.text_input("Nature of Business", key="loan_form_nature_of_business")
+        with col2:
+            st.text_input("Please specify the business activity", key="loan_form_business_activity")
+        st.markdown("---")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.markdown("Business Registration")
+        with col2:
+            st.markdown("Date of Business Registration")
+        with col3:
+            st.markdown("Expiry Date of Registration")
+        with col4:
+            st.markdown("Registration Number")
+        st.markdown("---")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.checkbox("DTI", value=True, key="loan_form_dti")
+        with col2:
+            st.date_input("DTI Date", datetime(2020, 7, 19), key="loan_form_dti_date")
+        with col3:
+            st.date_input("DTI Expiry", datetime(2025, 7, 19), key="loan_form_dti_expiry")
+        with col4:
+            st.text_input("DTI Reg. Number", value="12345678", key="loan_form_dti_reg_num")
+        st.markdown("---")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.checkbox("BIR", value=True, key="loan_form_bir")
+        with col2:
+            st.date_input("BIR Date", datetime(2020, 7, 19), key="loan_form_bir_date")
+        with col3:
+            st.date_input("BIR Expiry", datetime(2025, 7, 19), key="loan_form_bir_expiry")
+        with col4:
+            st.text_input("BIR Reg. Number", value="12345678", key="loan_form_bir_reg_num")
+        st.markdown("---")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.radio("Firm Size", ["Micro (not more than Php 3M)", "Small (Php 3m to 15M)", "Medium (Php 15M to 100M)"], index=None, key="loan_form_firm_size")
+        with col2:
+            st.text_input("Annual Sales Revenue", key="loan_form_annual_sales_revenue")
+            st.text_input("Number of Employees", key="loan_form_number_of_employees")
 
-    if st.session_state.show_application_form:
-        col1, col2, col3 = st.columns([1,4,1])
+@st.fragment
+def loan_information_section():
+    with tracing.span("loan_form.section_b"):
+        st.markdown("---")
+        st.markdown("### **B. LOAN APPLICATION INFORMATION**")
+        st.markdown("---")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.text_input("Loan Amount", key="loan_form_loan_amount")
         with col2:
-            with st.form("loan_application_form"):
-                col1, col2 = st.columns(2)
-                with col1:
-                    loan_type = st.radio("Loan Type", ["New Application", "Renewal", "Additional Loan", "Restructuring"], index=None)
-                with col2:
-                    previous_application = st.radio("In case of loan renewal or restructuring, are there any update from the previous application?", ["Yes", "No"], index=None)
-                business_type = st.radio("Business Type", ["Individual", "Sole Proprietorship"], index=None)
-                st.markdown("---")
-                st.markdown("### **A. BORROWER AND BUSINESS INFORMATION**")
-                st.markdown("---")
-                full_name = st.text_input("Name of the Borrower" , value=f"{data.get('First Name', '')} {data.get('Middle Name', '')} {data.get('Last Name', '')}")
-                col1, col2, col3, col4, col5 = st.columns(5)
-                with col1:
-                    civil_status = st.radio("Civil Status", ["Single", "Married", "Widowed", "Separated", "Annuled"], index=0)
-                with col2:
-                    date_of_birth_str = data.get("Birth Date", "")
-                    if date_of_birth_str:
-                        date_of_birth = datetime.strptime(date_of_birth_str, "%Y-%m-%d")
-                    else:
-                        date_of_birth = None
-                    birth_date = st.date_input("Birth Date", value=date_of_birth)
-                with col3:
-                    place_of_birth = st.text_input("Place of Birth", value=data.get("Place of Birth", ""))
-                with col4:
-                    citizenship = st.text_input("Citizenship", value="Filipino")
-                with col5:
-                    sex = st.radio("Sex", ["Male", "Female"] , index=0)
+            st.radio("Repayment Frequency", ["Weekly", "Monthly", "Quarterly", "Annually", "Lump sum"], index=None, key="loan_form_repayment_frequency")
 
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    spouse_name = st.text_input("Spouse Name")
-                with col2:
-                    spouse_birth_date = st.date_input("Spouse Birth Date", value=None)
-                home_address = st.text_input("Home Address", value=data.get("Taxpayer Address", ""))
-                col1, col2, col3 = st.columns([2,1,1])
-                with col1:
-                    home_ownership = st.radio("Home Address Ownership", ["Owned (unencumbered)", "Owned (mortgaged)", "Rented", "Living with Relatives"], index=2)
-                with col2:
-                    years_of_stay = st.text_input("Years of Stay", value=20)
-                with col3:
-                    telephone_number = st.text_input("Telephone Number", value=data.get("Telephone Number", ""))
-                col1, col2 = st.columns([1, 2])
-                with col1:
-                    mobile_number = st.text_input("Mobile Number", value="09471234567")
-                with col2:
-                    email_address = st.text_input("Email Address", value=data.get("Email", ""))
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    tin = st.text_input("TIN", value=data.get("Taxpayer TIN", ""))
-                with col2:
-                    philsys_id = st.text_input("PhilSys ID", value="101821186")
-                with col3:
-                    other_id = st.text_input("Other Government-Issued ID")
-                mothers_maiden_name = st.text_input("Mother's Maiden Name", value="GHA-GHA BORRES")
-                col1, col2, col3 = st.columns([3, 1, 1])
-                with col1:
-                    business_name = st.text_input("Registered Business Name", value=data.get("Business Name", ""))
-                with col2:
-                    years_of_business = st.text_input("Years in Operation", value="3")
-                with col3:
-                    num_of_branches = st.text_input("Number of Branches")
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    similar_to_home_address = st.radio("Is the Business Address similar to Home Address?", ["Yes", "No"], index=0)
-                    principal_business_address = st.text_input("Principal Business Address")
-                with col2:
-                    business_address_ownership = st.radio("Business Address Ownership", ["Owned (unencumbered)", "Owned (mortgaged)", "Rented"], index=None)
-                col1, col2 = st.columns(2)
-                with col1:
-                    website = st.text_input("Website/social media page", value="intelligent-ai.solutions")
-                with col2:
-                    indicate_business_has = st.radio("Indicate weather the business has", ["Female Manager", "Female head officer of operations"] , index=None)
-                col1, col2 = st.columns([1,2])
-                with col1:
-                    nature_of_business = st.text_input("Nature of Business", value=data.get("Line of Business", ""))
-                with col2:
-                    business_activity = st.text_input("Please specify the business activity")
-                st.markdown("---")
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.markdown("Business Registration")
-                with col2:
-                    st.markdown("Date of Business Registration")
-                with col3:
-                    st.markdown("Expiry Date of Registration")
-                with col4:
-                    st.markdown("Registration Number")
-                st.markdown("---")
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    dti = st.checkbox("DTI", value=True)
-                with col2:
-                    dti_date = st.date_input("DTI Date", datetime(2020, 7, 19))
-                with col3:
-                    dti_expiry = st.date_input("DTI Expiry", datetime(2025, 7, 19))
-                with col4:
-                    dti_reg_num = st.text_input("DTI Reg. Number", value="12345678")
-                st.markdown("---")
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    bir = st.checkbox("BIR", value=True)
-                with col2:
-                    bir_date = st.date_input("BIR Date", datetime(2020, 7, 19))
-                with col3:
-                    bir_expiry = st.date_input("BIR Expiry", datetime(2025, 7, 19))
-                with col4:
-                    bir_reg_num = st.text_input("BIR Reg. Number", value="12345678")
-                st.markdown("---")
-                col1, col2 = st.columns(2)
-                with col1:
-                    firm_size = st.radio("Firm Size", ["Micro (not more than Php 3M)", "Small (Php 3m to 15M)", "Medium (Php 15M to 100M)"], index=None)
-                with col2:
-                    annual_sales_revenue = st.text_input("Annual Sales Revenue", value=data.get("Total Revenue", ""))
-                    number_of_employees = st.text_input("Number of Employees")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.radio("Loan Facility", ["Credit Line", "Term Loan", "Others"], index=None, key="loan_form_loan_facility")
+        with col2:
+            st.radio("Loan Purpose", ["Working Capital", "Capital to start additional business", "Business expansion", "Acquisition of Trucks/Vehicles/Equipment", "Acquisition of Real Estate", "Construction", "Renovation", "Franchise Financing", "Trade Related Activities", "Loan Takeout"], index=None, key="loan_form_loan_purpose")
+        with col3:
+            st.text_input("Tenor (Months)", key="loan_form_tenor_months")
+        st.radio("Loan Type", ["Unsecured Loan", "Secured Loan"], index=None, key="loan_form_loan_security")
+        st.text_input("If secured, collateral offered:", key="loan_form_collateral")
 
-                st.markdown("---")
-                st.markdown("### **B. LOAN APPLICATION INFORMATION**")
-                st.markdown("---")
+@st.fragment
+def financial_information_section():
+    with tracing.span("loan_form.section_c"):
+        st.markdown("---")
+        st.markdown("### **C. FINANCIAL INFORMATION**")
+        st.markdown("---")
+        st.radio("Source of Repayment", ["Revenue", "Asset Sale", "Savings and/or Investment", "Inheritance", "Salary/Allowance", "Others"], index=None, key="loan_form_source_of_repayment")
+        st.markdown("---")
+        st.markdown("**Existing Deposit and E-money Account**")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.markdown("Name of Financial Institution")
+        with col2:
+            st.markdown("Type of Account")
+        with col3:
+            st.markdown("Year Opened")
+        with col4:
+            st.markdown("Type of Account Ownership")
 
-                col1, col2 = st.columns(2)
-                with col1:
-                    loan_amount = st.text_input("Loan Amount")
-                with col2:
-                    repayment_frequency = st.radio("Repayment Frequency", ["Weekly", "Monthly", "Quarterly", "Annually", "Lump sum"], index=None)
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.text_input("Deposit Name", key="loan_form_deposit_name")
+        with col2:
+            st.radio("Deposit Type", ["Savings", "Checking", "E-wallet", "Others"], index=1, key="loan_form_deposit_type")
+        with col3:
+            st.text_input("Year Opened", value="2018", key="loan_form_deposit_year_opened")
+        with col4:
+            st.radio("Deposit Ownership", ["Personal", "Business/Merchant"], index=0, key="loan_form_deposit_ownership")
+        st.markdown("---")
+        st.markdown("**Existing Loans**")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.markdown("Name of Financial Institution")
+        with col2:
+            st.markdown("Loan Amount")
+        with col3:
+            st.markdown("Date Granted")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.text_input("Loan Name", key="loan_form_loan_name")
+        with col2:
+            st.text_input("Existing Loan Amount", key="loan_form_existing_loan_amount")
+        with col3:
+            st.date_input("Date Granted", value=None, key="loan_form_loan_date_granted")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.markdown("Maturity Date")
+        with col2:
+            st.markdown("Outstanding Balance")
+        with col3:
+            st.markdown("Collateral/s Offered")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.date_input("Maturity Date", value=None, key="loan_form_loan_maturity_date")
+        with col2:
+            st.text_input("Outstanding Balance", key="loan_form_outstanding_balance")
+        with col3:
+            st.text_input("Collateral Offered", key="loan_form_collateral_offered")
+        st.markdown("---")
+        st.markdown("**Existing Credit Cards**")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.markdown("Name of Financial Institution")
+        with col2:
+            st.markdown("Credit Limit")
+        with col3:
+            st.markdown("Outstanding Balance")
+        with col4:
+            st.markdown("Type of Ownership")
 
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    loan_facility = st.radio("Loan Facility", ["Credit Line", "Term Loan", "Others"], index=None)
-                with col2:
-                    loan_purpose = st.radio("Loan Purpose", ["Working Capital", "Capital to start additional business", "Business expansion", "Acquisition of Trucks/Vehicles/Equipment", "Acquisition of Real Estate", "Construction", "Renovation", "Franchise Financing", "Trade Related Activities", "Loan Takeout"], index=None)
-                with col3:
-                    tenor_months = st.text_input("Tenor (Months)")
-                loan_type = st.radio("Loan Type", ["Unsecured Loan", "Secured Loan"], index=None)
-                collateral = st.text_input("If secured, collateral offered:")
-
-                st.markdown("---")
-                st.markdown("### **C. FINANCIAL INFORMATION**")
-                st.markdown("---")
-                source_of_repayment = st.radio("Source of Repayment", ["Revenue", "Asset Sale", "Savings and/or Investment", "Inheritance", "Salary/Allowance", "Others"], index=None)
-                st.markdown("---")
-                st.markdown("**Existing Deposit and E-money Account**")
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.markdown("Name of Financial Institution")
-                with col2:
-                    st.markdown("Type of Account")
-                with col3:
-                    st.markdown("Year Opened")
-                with col4:
-                    st.markdown("Type of Account Ownership")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.text_input("Credit Name", key="loan_form_credit_name")
+        with col2:
+            st.text_input("Credit Limit", value="100000", key="loan_form_credit_limit")
+        with col3:
+            st.text_input("Card Outstanding Balance", value="50000", key="loan_form_credit_outstanding_balance")
+        with col4:
+            st.radio("Credit Ownership", ["Personal", "Business"], index=0, key="loan_form_credit_ownership")
 
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    deposit_name = st.text_input("Deposit Name", value=data.get("Bank Name", ""))
-                with col2:
-                    deposit_type = st.radio("Deposit Type", ["Savings", "Checking", "E-wallet", "Others"], index=1)
-                with col3:
-                    deposit_year_opened = st.text_input("Year Opened", value="2018")
-                with col4:
-                    deposit_ownership = st.radio("Deposit Ownership", ["Personal", "Business/Merchant"], index=0)
-                st.markdown("---")
-                st.markdown("**Existing Loans**")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.markdown("Name of Financial Institution")
-                with col2:
-                    st.markdown("Loan Amount")
-                with col3:
-                    st.markdown("Date Granted")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    loan_name = st.text_input("Loan Name")
-                with col2:
-                    existing_loan_amount = st.text_input("Existing Loan Amount")
-                with col3:
-                    loan_date_granted = st.date_input("Date Granted", value=None)
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.markdown("Maturity Date")
-                with col2:
-                    st.markdown("Outstanding Balance")
-                with col3:
-                    st.markdown("Collateral/s Offered")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    loan_maturity_date = st.date_input("Maturity Date", value=None)
-                with col2:
-                    outstanding_balance = st.text_input("Outstanding Balance")
-                with col3:
-                    collateral_offered = st.text_input("Collateral Offered")
-                st.markdown("---")
-                st.markdown("**Existing Credit Cards**")
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.markdown("Name of Financial Institution")
-                with col2:
-                    st.markdown("Credit Limit")
-                with col3:
-                    st.markdown("Outstanding Balance")
-                with col4:
-                    st.markdown("Type of Ownership")
+def loan_application_form():
+    if 'show_application_form' not in st.session_state:
+        st.session_state.show_application_form = True
+        st.markdown("<h2 style='text-align: center; color: black;'>Business Loan Application Form</h2>", unsafe_allow_html=True)
 
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    credit_name = st.text_input("Credit Name", value=data.get("Bank Name", ""))
-                with col2:
-                    credit_limit = st.text_input("Credit Limit", value="100000")
-                with col3:
-                    credit_outstanding_balance = st.text_input("Card Outstanding Balance", value="50000")
-                with col4:
-                    credit_ownership = st.radio("Credit Ownership", ["Personal", "Business"], index=0)
-                st.divider()
-                col1, col2, col3 = st.columns([1, 4, 1])
-                with col3:
-                    submitted = st.form_submit_button("Submit", use_container_width=True, type="primary")
-                with col1:
-                    cancel = st.form_submit_button("Cancel", use_container_width=True, type="secondary")
-                if submitted:
-                    st.session_state.show_application_form = False
-                    st.session_state.show_loan_application_results = True
-                    st.rerun()
-                if cancel:
-                    st.session_state.show_application_form = False
-                    st.session_state.home = True
-                    st.rerun()
+    if st.session_state.show_application_form:
+        prefill_loan_form()
+        col1, col2, col3 = st.columns([1,4,1])
+        with col2:
+            borrower_and_business_section()
+            loan_information_section()
+            financial_information_section()
+            st.divider()
+            col1, col2, col3 = st.columns([1, 4, 1])
+            with col3:
+                submitted = st.button("Submit", use_container_width=True, type="primary")
+            with col1:
+                cancel = st.button("Cancel", use_container_width=True, type="secondary")
+            if submitted:
+                st.session_state.show_application_form = False
+                st.session_state.show_loan_application_results = True
+                st.rerun()
+            if cancel:
+                st.session_state.show_application_form = False
+                st.session_state.home = True
+                st.rerun()
 
 def loan_application_results(loan_type):
     # Main content
@@ -709,10 +602,6 @@ def loan_application_results(loan_type):
         """, unsafe_allow_html=True)
 
 def homepage():
-
-    if "home" not in st.session_state:
-        st.session_state.home = True
-
     if st.session_state.home:
         st.markdown("<h1 style='text-align: center; color: #AC0D19;'>Welcome to BPI Ka-Negosyo Loans</h1>", unsafe_allow_html=True)
         st.markdown("""
@@ -746,19 +635,20 @@ def homepage():
                 st.rerun()
 
 def main():
-    homepage()
-
-    if st.session_state.show_eligibility_checker:
-        eligibility_checker_form()
-
-    if st.session_state.show_loan_application_form:
-        loan_application_form()
-
-    if st.session_state.show_eligibility_result:
-        eligibility_results()
-
-    if st.session_state.show_loan_application_results:
-        loan_application_results("Ka-Negosyo Credit Line")
+    # Only the active view is built. A submitted loan application keeps its form flag
+    # set, so the results views are checked before the forms that lead to them.
+    with tracing.span("page.main"):
+        if st.session_state.home:
+            homepage()
+        elif st.session_state.show_loan_application_results:
+            loan_application_results("Ka-Negosyo Credit Line")
+        elif st.session_state.show_eligibility_checker:
+            # Also shows the eligibility results once the checker form is submitted
+            eligibility_checker_form()
+        elif st.session_state.show_loan_application_form:
+            loan_application_form()
+        elif st.session_state.show_eligibility_result:
+            eligibility_results()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""Process-wide counters and value distributions for app-level metrics.
+
+Streamlit re-executes page scripts on every rerun, so anything that has to
+outlive a rerun (and be shared across sessions) is kept here.
+
+Keyword arguments are labels: increment("upstream.retries", upstream="psgc")
+is kept under 'upstream.retries{upstream="psgc"}', which is also how the
+Prometheus export names it.
+"""
+import threading
+from collections import defaultdict, deque
+
+# Observations kept per distribution for percentiles
+WINDOW = 1000
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = defaultdict(int)
+_distributions = defaultdict(lambda: deque(maxlen=WINDOW))
+# Lifetime [count, sum] per distribution, for cumulative exports such as Prometheus summaries
+_totals = defaultdict(lambda: [0, 0.0])
+
+
+def key(name, **labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in sorted(labels.items())) + "}"
+
+
+def increment(name, amount=1, **labels):
+    with _lock:
+        _counters[key(name, **labels)] += amount
+
+
+def observe(name, value, **labels):
+    name = key(name, **labels)
+    with _lock:
+        _distributions[name].append(value)
+        totals = _totals[name]
+        totals[0] += 1
+        totals[1] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[key(name, **labels)] = value
+
+
+def add_to_gauge(name, amount, **labels):
+    with _lock:
+        _gauges[key(name, **labels)] += amount
+
+
+def counter(name, **labels):
+    with _lock:
+        return _counters.get(key(name, **labels), 0)
+
+
+def gauge(name, **labels):
+    with _lock:
+        return _gauges.get(key(name, **labels), 0)
+
+
+def distribution_stats(name, **labels):
+    name = key(name, **labels)
+    with _lock:
+        values = sorted(_distributions.get(name, ()))
+        total, total_sum = _totals.get(name, (0, 0.0))
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None,
+                "total": total, "sum": total_sum}
+    return {
+        "count": len(values),
+        "total": total,
+        "sum": total_sum,
+        "mean": sum(values) / len(values),
+        "p50": _percentile(values, 0.50),
+        "p95": _percentile(values, 0.95),
+        "p99": _percentile(values, 0.99),
+        "max": values[-1],
+    }
+
+
+def snapshot():
+    """All counters, gauges and distribution summaries, for logging or export."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        names = list(_distributions)
+    return {
+        "counters": counters,
+        "gauges": gauges,
+        "distributions": {name: distribution_stats(name) for name in names},
+    }
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
@@ -0,0 +1,393 @@
+"""Document extraction through the OpenAI Batch API, for bulk and overnight jobs.
+
+Batch requests cost half as much as synchronous ones and count against a
+separate limit, so re-extraction jobs don't compete with applicants using the
+app. The requests are the ones the eligibility form sends
+(extraction.build_extraction_request), packed into JSONL input files of at most
+BATCH_FILE_MAX_MB and BATCH_FILE_MAX_REQUESTS each. Documents already in the
+extraction cache aren't sent, and the replies are written back to it.
+
+A job is tracked in a JSON file, so submitting, polling and collecting can
+happen in separate runs:
+
+    python openai_batch.py submit packets/ --job jobs/nightly.json
+    python openai_batch.py status --job jobs/nightly.json
+    python openai_batch.py collect --job jobs/nightly.json --output profiles.jsonl --wait
+    python openai_batch.py run manifest.jsonl --job /tmp/job.json --output profiles.jsonl --stub
+
+Packets are read with batch_extraction.load_packets, and the output has the same
+one-line-per-applicant format as batch_extraction.py, except that "seconds" is
+null: batches are timed as a whole, not per applicant. Re-running `submit` on a
+job that failed partway resumes it, sending only the applicants it doesn't have
+yet. `run --stub` (or passing
+StubBatchClient() to the functions below) answers batches in process without
+calling OpenAI.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+from batch_extraction import load_packets, merge_profile
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# The Batch API takes up to 200 MB and 50,000 requests per input file
+BATCH_FILE_MAX_BYTES = int(float(os.getenv("BATCH_FILE_MAX_MB", "190")) * 2**20)
+BATCH_FILE_MAX_REQUESTS = int(os.getenv("BATCH_FILE_MAX_REQUESTS", "50000"))
+POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "60"))
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _call(func, *args, **kwargs):
+    from http_clients import upstream
+
+    return upstream("openai-batch").call(func, *args, **kwargs)
+
+
+def _default_client():
+    from http_clients import openai_client
+
+    return openai_client()
+
+
+def load_job(job_path):
+    with open(job_path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_job(job, job_path):
+    os.makedirs(os.path.dirname(os.path.abspath(job_path)), exist_ok=True)
+    temporary = f"{job_path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(job, file, ensure_ascii=False, default=str)
+    os.replace(temporary, job_path)
+
+
+class _InputFile:
+    """A JSONL batch input file being filled, under the API's size and request limits."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, f"batch-input-{uuid.uuid4().hex}.jsonl")
+        self.file = open(self.path, "wb")
+        self.bytes = 0
+        self.requests = 0
+        self.custom_ids = []
+
+    def fits(self, line):
+        return self.requests == 0 or (
+            self.bytes + len(line) <= BATCH_FILE_MAX_BYTES and self.requests < BATCH_FILE_MAX_REQUESTS
+        )
+
+    def add(self, custom_id, line):
+        self.custom_ids.append(custom_id)
+        self.file.write(line)
+        self.bytes += len(line)
+        self.requests += 1
+
+
+def submit(packets, job_path, client=None, metadata=None):
+    """Builds, uploads and submits the batches for `packets`; returns the job, which is also saved to job_path.
+
+    If job_path already tracks a job that hasn't been collected, the submission is
+    resumed: applicants the job already has are skipped and the rest are sent.
+    """
+    from extraction import build_extraction_request, extraction_cache, parse_extracted_fields, prompt_fingerprint
+
+    client = client or _default_client()
+    if os.path.exists(job_path):
+        job = load_job(job_path)
+        if job["collected"]:
+            raise FileExistsError(f"{job_path} tracks a job that was already collected; pick another path")
+        logger.info("Resuming %s: %d applicants already submitted", job_path, len(job["applicants"]))
+        # An applicant whose requests were only partly sent is sent again in full; replies to
+        # the first attempt are then skipped by collect()
+        job["requests"] = {
+            custom_id: request for custom_id, request in job["requests"].items()
+            if request["applicant"] in job["applicants"]
+        }
+    else:
+        job = {
+            "created_at": time.time(), "batches": [], "requests": {}, "applicants": {}, "errors": {}, "collected": False,
+        }
+    # Applicants and requests only enter the job once their batch exists, so a
+    # failed upload leaves them out of the job file and a resumed run sends them again
+    pending_requests = {}
+    pending_applicants = {}
+    # Custom IDs are handed out in order, so every ID below this one has been sent
+    next_id = sum(entry["requests"] for entry in job["batches"])
+
+    def add_applicant(name):
+        job["applicants"][name] = pending_applicants.pop(name)["record"]
+
+    def send(input_file):
+        input_file.file.close()
+        try:
+            uploaded = _call(client.files.create, file=Path(input_file.path), purpose="batch")
+            batch = _call(
+                client.batches.create,
+                input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window=COMPLETION_WINDOW,
+                metadata={"source": "openai_batch.py", **(metadata or {})},
+            )
+        finally:
+            os.remove(input_file.path)
+        for custom_id in input_file.custom_ids:
+            request = pending_requests.pop(custom_id)
+            job["requests"][custom_id] = {**request, "batch_id": batch.id}
+            applicant = pending_applicants[request["applicant"]]
+            applicant["unsent"].discard(custom_id)
+            if applicant["complete"] and not applicant["unsent"]:
+                add_applicant(request["applicant"])
+        job["batches"].append({
+            "id": batch.id, "input_file_id": uploaded.id, "requests": input_file.requests, "status": batch.status,
+            "output_file_id": None, "error_file_id": None, "collected": False,
+        })
+        # Saved after every batch, so batches already submitted are never lost track of
+        save_job(job, job_path)
+        logger.info("Submitted batch %s: %d requests, %.1f MB", batch.id, input_file.requests, input_file.bytes / 2**20)
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_file = _InputFile(directory)
+        for packet in packets:
+            name = packet["applicant"]
+            if name in job["applicants"]:
+                continue
+            applicant = {"record": {"documents": {}, "errors": {}}, "unsent": set(), "complete": False}
+            pending_applicants[name] = applicant
+            has_middle_name = packet.get("has_middle_name") or {}
+            for document_type, path in packet["documents"].items():
+                middle_name = has_middle_name.get(document_type, document_type == "ID")
+                try:
+                    with open(path, "rb") as file:
+                        image_bytes = file.read()
+                    cache_key = extraction_cache.make_key(
+                        image_bytes, document_type, middle_name, prompt_fingerprint(document_type, middle_name)
+                    )
+                    cached = extraction_cache.get(cache_key)
+                    if cached is not None:
+                        applicant["record"]["documents"][document_type] = parse_extracted_fields(cached, document_type)
+                        continue
+                    request = build_extraction_request(image_bytes, document_type, middle_name)
+                except Exception as error:
+                    applicant["record"]["errors"][document_type] = f"{type(error).__name__}: {error}"
+                    continue
+
+                custom_id = str(next_id)
+                next_id += 1
+                line = (json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": request}) + "\n").encode("utf-8")
+                if not input_file.fits(line):
+                    send(input_file)
+                    input_file = _InputFile(directory)
+                input_file.add(custom_id, line)
+                pending_requests[custom_id] = {"applicant": name, "document_type": document_type, "cache_key": cache_key}
+                applicant["unsent"].add(custom_id)
+            applicant["complete"] = True
+            if not applicant["unsent"]:
+                add_applicant(name)
+        if input_file.requests:
+            send(input_file)
+        else:
+            input_file.file.close()
+
+    save_job(job, job_path)
+    return job
+
+
+def refresh(job_path, client=None):
+    """Updates the status of the job's unfinished batches; returns the job."""
+    client = client or _default_client()
+    job = load_job(job_path)
+    for entry in job["batches"]:
+        if entry["status"] in TERMINAL_STATUSES:
+            continue
+        batch = _call(client.batches.retrieve, entry["id"])
+        entry.update(status=batch.status, output_file_id=batch.output_file_id, error_file_id=batch.error_file_id)
+    save_job(job, job_path)
+    return job
+
+
+def is_finished(job):
+    return all(entry["status"] in TERMINAL_STATUSES for entry in job["batches"])
+
+
+def collect(job_path, output_path, client=None, wait=False, poll_seconds=POLL_SECONDS):
+    """Maps finished batches back to applicants and writes their profiles; returns the number written.
+
+    Without `wait`, returns None while batches are still running. Successful replies
+    are added to the extraction cache, so later runs and the app reuse them.
+    """
+    from extraction import extraction_cache, parse_extracted_fields
+
+    client = client or _default_client()
+    job = refresh(job_path, client)
+    while wait and not is_finished(job):
+        time.sleep(poll_seconds)
+        job = refresh(job_path, client)
+    if not is_finished(job):
+        return None
+    if job["collected"]:
+        logger.info("%s was already collected", job_path)
+        return 0
+    job.setdefault("errors", {})
+
+    for entry in job["batches"]:
+        if entry["collected"]:
+            continue
+        answered = set()
+        for file_id in (entry["output_file_id"], entry["error_file_id"]):
+            if not file_id:
+                continue
+            content = _call(client.files.content, file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                custom_id = result["custom_id"]
+                answered.add(custom_id)
+                request = job["requests"].get(custom_id)
+                applicant = job["applicants"].get(request["applicant"]) if request else None
+                if applicant is None:
+                    # Sent by a submit that crashed before the job recorded the request or its
+                    # applicant; a resumed submit sends that applicant again
+                    job["errors"][custom_id] = "reply for a request or applicant this job doesn't track"
+                    logger.warning("Batch %s: skipping reply %s, which the job doesn't track", entry["id"], custom_id)
+                    continue
+                document_type = request["document_type"]
+                try:
+                    output = _reply_content(result, document_type)
+                    applicant["documents"][document_type] = parse_extracted_fields(output, document_type)
+                    extraction_cache.set(request["cache_key"], output)
+                except Exception as error:
+                    applicant["errors"][document_type] = f"{type(error).__name__}: {error}"
+        # Requests of a failed, expired or cancelled batch that never got a reply
+        for custom_id, request in job["requests"].items():
+            if request["batch_id"] == entry["id"] and custom_id not in answered and request["applicant"] in job["applicants"]:
+                job["applicants"][request["applicant"]]["errors"][request["document_type"]] = f"batch {entry['status']}"
+        entry["collected"] = True
+        save_job(job, job_path)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "a", encoding="utf-8") as output:
+        for name, applicant in job["applicants"].items():
+            record = {"applicant": name, "profile": merge_profile(applicant["documents"]), **applicant, "seconds": None}
+            output.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    job["collected"] = True
+    save_job(job, job_path)
+    return len(job["applicants"])
+
+
+def _reply_content(result, document_type):
+    if result.get("error"):
+        raise RuntimeError(result["error"].get("message", result["error"]))
+    response = result["response"]
+    if response["status_code"] != 200:
+        raise RuntimeError(f"HTTP {response['status_code']}: {response['body'].get('error', {}).get('message', '')}")
+    message = response["body"]["choices"][0]["message"]
+    if message.get("refusal"):
+        raise ValueError(f"Model refused to extract the {document_type}: {message['refusal']}")
+    return message["content"]
+
+
+class StubBatchClient:
+    """In-process stand-in for the OpenAI files and batches endpoints, for tests and dry runs.
+
+    A batch completes the first time it is retrieved. Each request is answered by
+    `respond(body)`, which returns the reply text; by default every field in the
+    request's JSON schema is null.
+    """
+
+    def __init__(self, respond=None):
+        from fake_services import schema_reply
+
+        self.respond = respond or (lambda body: schema_reply(body["response_format"]))
+        self._files = {}
+        self._batches = {}
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _create_file(self, file, purpose):
+        file_id = f"file-{uuid.uuid4().hex}"
+        self._files[file_id] = Path(file).read_bytes() if isinstance(file, os.PathLike) else file.read()
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id):
+        data = self._files[file_id]
+        return SimpleNamespace(content=data, text=data.decode("utf-8"))
+
+    def _create_batch(self, input_file_id, endpoint, completion_window, metadata=None):
+        batch = SimpleNamespace(id=f"batch_{uuid.uuid4().hex}", input_file_id=input_file_id, endpoint=endpoint,
+                                status="validating", output_file_id=None, error_file_id=None, metadata=metadata)
+        self._batches[batch.id] = batch
+        return batch
+
+    def _retrieve_batch(self, batch_id):
+        batch = self._batches[batch_id]
+        if batch.status == "validating":
+            lines = []
+            for line in self._files[batch.input_file_id].decode("utf-8").splitlines():
+                request = json.loads(line)
+                body = {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "model": request["body"]["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                        "role": "assistant", "content": self.respond(request["body"]), "refusal": None,
+                    }}],
+                }
+                lines.append(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body}, "error": None,
+                }))
+            batch.output_file_id = f"file-{uuid.uuid4().hex}"
+            self._files[batch.output_file_id] = ("\n".join(lines) + "\n").encode("utf-8")
+            batch.status = "completed"
+        return batch
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    submit_parser = subparsers.add_parser("submit", help="build and submit batches for a directory or manifest")
+    status_parser = subparsers.add_parser("status", help="show the job's batches")
+    collect_parser = subparsers.add_parser("collect", help="write the profiles once every batch has finished")
+    run_parser = subparsers.add_parser("run", help="submit, wait and collect in one go")
+    for subparser in (submit_parser, run_parser):
+        subparser.add_argument("source", help="directory of applicant folders, or a JSONL manifest")
+    for subparser in (submit_parser, status_parser, collect_parser, run_parser):
+        subparser.add_argument("--job", required=True, help="JSON file tracking the job")
+    for subparser in (collect_parser, run_parser):
+        subparser.add_argument("--output", required=True, help="JSONL file the profiles are appended to")
+        subparser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS)
+    collect_parser.add_argument("--wait", action="store_true", help="poll until every batch has finished")
+    run_parser.add_argument("--stub", action="store_true", help="answer batches in process instead of calling OpenAI")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    client = StubBatchClient() if getattr(args, "stub", False) else None
+    if args.command in ("submit", "run"):
+        job = submit(load_packets(args.source), args.job, client)
+        print("Submitted %d requests in %d batches" % (len(job["requests"]), len(job["batches"])))
+    if args.command == "status":
+        for entry in refresh(args.job)["batches"]:
+            print("%s  %-11s %6d requests" % (entry["id"], entry["status"], entry["requests"]))
+    if args.command in ("collect", "run"):
+        written = collect(args.job, args.output, client, wait=args.command == "run" or args.wait,
+                          poll_seconds=args.poll_seconds)
+        if written is None:
+            print("Batches are still running; collect again later or pass --wait")
+            return 2
+        print("Wrote %d profiles to %s" % (written, args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
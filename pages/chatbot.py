@@ -1,48 +1,48 @@
 import streamlit as st
 import time
 import base64
+import io
 from pathlib import Path
-import nltk
-from langchain_openai import OpenAIEmbeddings
-from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain_openai import ChatOpenAI
-from pinecone_text.sparse import BM25Encoder
-from pinecone import Pinecone as PineconeClient
-from langchain_community.retrievers import PineconeHybridSearchRetriever
 import os
 from dotenv import load_dotenv
-from functools import lru_cache
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from typing import Optional
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.memory import ChatMessageHistory
-from langchain.chains.combine_documents import create_stuff_documents_chain
-import uuid
 import asyncio
+import logging
+import tracemalloc
+import async_runtime
+import context_budget
+import metrics
+import tracing
+from query_rewriter import QueryRewriter
+
+# langchain, pinecone, pinecone_text and openai are imported inside the loaders
+# below: the page renders without them, and they load once per process when the
+# first question comes in. `python startup_profile.py` reports what the page imports.
 
 load_dotenv()
 
-# Lazy download nltk data only if not already downloaded
-if "nltk_data" not in st.session_state:
-    nltk.download('punkt_tab')
-    st.session_state.nltk_data = True
+logger = logging.getLogger(__name__)
 
-# Function to convert an image file to a base64 string
-def image_to_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+# /metrics and /traces for this process when METRICS_PORT is set (see tracing.py)
+tracing.start_metrics_server()
 
+AVATAR_DIR = Path(__file__).resolve().parent.parent / "avatar"
+# Avatars are shown at 40px; 80px keeps them sharp on high-density screens
+AVATAR_PIXELS = 80
 
-# Paths to the avatar images on your computer (Replace with your actual paths)
-user_avatar_path = Path(r"/mount/src/hackathon/avatar/human.png")
-assistant_avatar_path = Path(r"/mount/src/hackathon/avatar/ai.png")
 
-# user_avatar_path = Path(r"C:\Users\Japs\PycharmProjects\hackathon\streamlit\avatar\human.png")
-# assistant_avatar_path = Path(r"C:\Users\Japs\PycharmProjects\hackathon\streamlit\avatar\ai.png")
+@st.cache_resource(show_spinner=False)
+def avatar_data_uri(filename):
+    """Downscaled avatar as a PNG data URI, encoded once per process."""
+    from PIL import Image
+
+    with Image.open(AVATAR_DIR / filename) as image:
+        image.thumbnail((AVATAR_PIXELS, AVATAR_PIXELS), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format="PNG", optimize=True)
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode("ascii")
 
-# Convert images to base64
-user_avatar_base64 = image_to_base64(user_avatar_path)
-assistant_avatar_base64 = image_to_base64(assistant_avatar_path)
 
 # CSS for fixed-height scrollable chat area and alignment
 st.markdown("""
@@ -80,53 +80,141 @@ st.markdown("""
         height: 40px;
         border-radius: 50%;
         margin: 5px;
+        flex-shrink: 0;
+        background-size: cover;
     }
     </style>
 """, unsafe_allow_html=True)
 
-# Cache heavy operations like loading embeddings
+# Each avatar is sent once per page as a CSS class rather than inlined in every bubble
+st.markdown(f"""
+    <style>
+    .user-avatar {{ background-image: url("{avatar_data_uri("human.png")}"); }}
+    .assistant-avatar {{ background-image: url("{avatar_data_uri("ai.png")}"); }}
+    </style>
+""", unsafe_allow_html=True)
+
+# Clients below are shared by every session in the process (one connection pool
+# each) and created on first use. Cached resources with a health check are
+# re-checked at most every RESOURCE_HEALTH_CHECK_SECONDS; a failed check makes
+# Streamlit build a fresh one, which reconnects.
+RESOURCE_HEALTH_CHECK_SECONDS = float(os.getenv("RESOURCE_HEALTH_CHECK_SECONDS", "300"))
+TRACE_SESSION_MEMORY = os.getenv("CHAT_TRACE_MEMORY") == "1"
+
+def periodic_health_check(check):
+    """Returns a validate hook for st.cache_resource that runs `check(resource)` now and then."""
+    checked_at = {}
+
+    def validate(resource):
+        now = time.monotonic()
+        if now - checked_at.get(id(resource), 0.0) < RESOURCE_HEALTH_CHECK_SECONDS:
+            return True
+        checked_at[id(resource)] = now
+        try:
+            check(resource)
+        except Exception:
+            logger.warning("Health check failed for %s; reconnecting", type(resource).__name__, exc_info=True)
+            checked_at.pop(id(resource), None)
+            return False
+        return True
+
+    return validate
+
 def load_embeddings():
-    return OpenAIEmbeddings(model="text-embedding-3-large")
+    from embedding_store import shared_embeddings
+
+    # Vectors are memoized on disk and concurrent queries from all sessions are batched
+    return shared_embeddings("text-embedding-3-large")
+
+def check_index(index):
+    import local_search
+
+    # The in-process index has nothing to reconnect
+    if not isinstance(index, local_search.LocalHybridIndex):
+        stats = index.describe_index_stats()
+        # Re-indexing the knowledge base changes the vector count, which drops retrievals cached before it
+        load_retrieval_cache().set_index_version(f"{KNOWLEDGE_BASE_VERSION}:{stats.total_vector_count}")
+
+KNOWLEDGE_BASE_VERSION = os.getenv("KNOWLEDGE_BASE_VERSION", os.getenv("PINECONE_INDEX_NAME", ""))
+
+# RETRIEVAL_BACKEND=local searches an in-process copy of the knowledge base (see local_search.py)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "pinecone")
+
+@st.cache_resource(show_spinner=False, validate=periodic_health_check(check_index))
+def load_index():
+    if RETRIEVAL_BACKEND == "local":
+        import local_search
 
-def bm25_encoder():
-    return BM25Encoder().default()
+        return local_search.load_index()
+    from pinecone import Pinecone as PineconeClient
 
-def initialize_pinecone_client(api_key, index_name):
-    pc = PineconeClient(api_key=api_key)
-    index = pc.Index(index_name)
-    return index
+    pc = PineconeClient(api_key=os.getenv('PINECONE_API_KEY'))
+    # A known host skips the control-plane lookup (and lets benchmarks point at fake_services.py)
+    if os.getenv("PINECONE_INDEX_HOST"):
+        return pc.Index(host=os.getenv("PINECONE_INDEX_HOST"))
+    return pc.Index(os.getenv('PINECONE_INDEX_NAME'))
+
+@st.cache_resource(show_spinner=False)
+def load_llm():
+    from langchain_openai import ChatOpenAI
 
-def initialize_llm(callback_manager):
     return ChatOpenAI(
         model="gpt-4-turbo",
         temperature=0,
         streaming=True,
-        callback_manager=callback_manager,
         request_timeout=30,
         )
-callback_manager = CallbackManager([StreamingStdOutCallbackHandler()])
-
-if "embeddings" not in st.session_state:
-    st.session_state.embeddings = load_embeddings()
-embeddings = st.session_state.embeddings
 
-if "pinecone_index" not in st.session_state:
-    st.session_state.pinecone_index = initialize_pinecone_client(os.getenv('PINECONE_API_KEY'), os.getenv('PINECONE_INDEX_NAME'))
-index = st.session_state.pinecone_index
+# Question rewriting is a short, simple task; a smaller model keeps it off the critical path
+@st.cache_resource(show_spinner=False)
+def load_rewrite_llm():
+    from langchain_openai import ChatOpenAI
 
-if "bm25_encoder" not in st.session_state:
-    st.session_state.bm25_encoder = bm25_encoder()
-bm25_encoder = st.session_state.bm25_encoder
+    return ChatOpenAI(
+        model=os.getenv("QUERY_REWRITE_MODEL", "gpt-4o-mini"),
+        temperature=0,
+        max_tokens=int(os.getenv("QUERY_REWRITE_MAX_TOKENS", "100")),
+        request_timeout=15,
+        )
 
-if "llm" not in st.session_state:
-    st.session_state.llm = initialize_llm(callback_manager)
-llm = st.session_state.llm
+@st.cache_resource(show_spinner=False)
+def load_query_rewriter():
+    return QueryRewriter(max_entries=int(os.getenv("QUERY_REWRITE_CACHE_SIZE", "1000")))
+
+# Shared by every session and rerun in the process; set RETRIEVAL_CACHE_PATH to share it across workers.
+# check_index moves it to a new index version when the Pinecone index changes.
+@st.cache_resource(show_spinner=False)
+def load_retrieval_cache():
+    from retrieval_cache import RetrievalCache
+
+    return RetrievalCache(
+        index_version=KNOWLEDGE_BASE_VERSION,
+        ttl_seconds=int(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "3600")),
+        similarity_threshold=float(os.getenv("RETRIEVAL_CACHE_SIMILARITY", "0.95")),
+        path=os.getenv("RETRIEVAL_CACHE_PATH") or None,
+    )
 
-retriever = PineconeHybridSearchRetriever(embeddings=embeddings, sparse_encoder=bm25_encoder, index=index)
-# Create a cached version of the retriever
-@lru_cache(maxsize=1000)
-def cached_retrieval(query: str):
-    return retriever.get_relevant_documents(query)
+# In-flight searches are shared, so a query that is already being retrieved
+# (for example the speculative one) is not sent to Pinecone a second time
+retrieval_tasks = {}
+RETRIEVAL_TASKS_SIZE = 1000
+
+async def search(query: str) -> list:
+    with tracing.span("chat.search") as current:
+        documents = await retriever.ainvoke(query)
+        current.set("documents", len(documents))
+        return documents
+
+def cached_retrieval(query: str) -> asyncio.Future:
+    task = retrieval_tasks.get(query)
+    if task is None or task.cancelled() or (task.done() and task.exception() is not None):
+        task = asyncio.ensure_future(search(query))
+        # Mark failures as seen; a speculative search nobody awaits shouldn't log a warning
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        retrieval_tasks[query] = task
+        if len(retrieval_tasks) > RETRIEVAL_TASKS_SIZE:
+            retrieval_tasks.pop(next(iter(retrieval_tasks)))
+    return task
 
 
 # Optimize prompts by reducing tokens
@@ -164,84 +252,191 @@ Your name is GAB, a friendly and accommodating MSME loan bank specialist who und
 {context}
 """
 
-# Create optimized prompt templates
-contextualize_q_prompt = ChatPromptTemplate.from_messages([
-    ("system", CONTEXTUALIZE_SYSTEM_PROMPT),
-    MessagesPlaceholder("chat_history"),
-    ("human", "{input}")
-])
-
-qa_prompt = ChatPromptTemplate.from_messages([
-    ("system", QA_SYSTEM_PROMPT),
-    MessagesPlaceholder("chat_history"),
-    ("human", "{input}")
-])
-
+def build_prompts():
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    contextualize_q_prompt = ChatPromptTemplate.from_messages([
+        ("system", CONTEXTUALIZE_SYSTEM_PROMPT),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}")
+    ])
+    qa_prompt = ChatPromptTemplate.from_messages([
+        ("system", QA_SYSTEM_PROMPT),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}")
+    ])
+    return contextualize_q_prompt, qa_prompt
+
+
+def build_question_answer_chain(llm, qa_prompt):
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+
+    return create_stuff_documents_chain(
+        llm,
+        qa_prompt,
+        document_variable_name="context",
+    )
 
-# Optimized history-aware retriever
-def create_optimized_retriever(query: str, chat_history: Optional[list] = None) -> list:
-    """Optimized retriever that uses caching and minimal token usage"""
-    if not chat_history:
-        return cached_retrieval(query)
 
-    # Only contextualize if there's relevant chat history
-    contextualized_q = llm.invoke(
+async def contextualize(query: str, chat_history: list) -> str:
+    contextualized_q = await rewrite_llm.ainvoke(
         contextualize_q_prompt.format(
             chat_history=chat_history[-3:],  # Only use last 3 messages
             input=query
         )
     )
-    return cached_retrieval(contextualized_q.content)
+    return contextualized_q.content
 
 
-# Optimized question-answer chain
-question_answer_chain = create_stuff_documents_chain(
-    llm,
-    qa_prompt,
-    document_variable_name="context",
-)
-
-
-# Session management with TTL cache
-class SessionManager:
-    def __init__(self, ttl_seconds: int = 3600):
-        self.sessions = {}
-        self.ttl = ttl_seconds
-
-    def get_session(self, session_id: Optional[str] = None) -> tuple:
-        if session_id is None:
-            session_id = str(uuid.uuid4())
-        if session_id not in self.sessions:
-            self.sessions[session_id] = ChatMessageHistory()
-        return session_id, self.sessions[session_id]
-
-
-session_mgr = SessionManager()
-
-
-async def process_query(query: str, session_id: Optional[str] = None) -> str:
-    """Main async function to process queries"""
-    session_id, history = session_mgr.get_session(session_id)
-
-    # Get relevant documents
-    docs = create_optimized_retriever(query, history.messages)
-
-    # Generate response
-    response = question_answer_chain.invoke({
-        "input": query,
-        "chat_history": history.messages[-3:],  # Only use recent history
-        "context": docs
-    })
+# Optimized history-aware retriever
+async def create_optimized_retriever(query: str, chat_history: Optional[list] = None) -> list:
+    """Optimized retriever that uses caching and minimal token usage"""
+    with tracing.span("chat.retrieve") as current:
+        # Standalone questions skip the rewrite entirely (see query_rewriter.needs_rewrite)
+        if not query_rewriter.needed(query, chat_history):
+            current.set("rewrite", "skipped")
+            return await cached_retrieval(query)
+
+        # Retrieve on the raw query while it is being contextualized; questions that are
+        # already standalone come back unchanged and use this result straight away
+        speculative = cached_retrieval(query)
+
+        rewritten = await query_rewriter.rewrite(query, chat_history, contextualize)
+        if rewritten.casefold() == query.strip().casefold():
+            current.set("rewrite", "unchanged")
+            metrics.increment("chat.speculative_retrieval_hits")
+            return await speculative
+        current.set("rewrite", "changed")
+        metrics.increment("chat.speculative_retrieval_misses")
+        return await cached_retrieval(rewritten)
+
+
+# Chat histories for every session in the process, keyed by Streamlit session ID
+# (see chat_sessions.py; CHAT_SESSION_STORE=sqlite keeps them across restarts)
+@st.cache_resource(show_spinner=False)
+def get_session_store():
+    from chat_sessions import create_session_store
+
+    return create_session_store()
+
+# CHAT_SUMMARIZE=1 folds trimmed turns into a running summary instead of dropping them
+SUMMARIZE_OLD_TURNS = os.getenv("CHAT_SUMMARIZE") == "1"
+SUMMARIZE_PROMPT = """Update the summary of an MSME's loan conversation with GAB using the messages below. \
+Keep the business details and answers the MSME gave. Reply with the summary only, in at most 5 sentences."""
+
+async def summarize_old_turns(summary: str, messages: list) -> str:
+    transcript = "\n".join(f"{message.type}: {message.content}" for message in messages)
+    reply = await llm.ainvoke([
+        ("system", SUMMARIZE_PROMPT),
+        ("human", f"Summary so far: {summary or '(none)'}\n\nMessages:\n{transcript}"),
+    ])
+    return reply.content.strip()
+
+
+# Token budgets for the QA prompt, counted with the chat model's tokenizer
+QA_MODEL = "gpt-4-turbo"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKENS", "1500"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKENS", "600"))
+
+
+async def process_query(query: str, session_id: str):
+    """Main async function to process queries; yields the answer chunk by chunk as it streams in"""
+    from langchain_core.messages import SystemMessage
+
+    with tracing.span("chat.pipeline") as pipeline:
+        session = session_store.get(session_id)
+        history = session.history.messages
+        recent_history, history_tokens = context_budget.trim_history(history, HISTORY_TOKEN_BUDGET, QA_MODEL)
+        if session.summary:
+            recent_history = [SystemMessage(f"Earlier in this conversation: {session.summary}")] + recent_history
+            history_tokens += context_budget.count_tokens(session.summary, QA_MODEL)
+
+        # Get relevant documents, keeping the best-scoring distinct ones that fit the budget
+        docs = await create_optimized_retriever(query, history)
+        docs, context_tokens = context_budget.select_documents(docs, CONTEXT_TOKEN_BUDGET, QA_MODEL)
+
+        query_tokens = context_budget.count_tokens(query, QA_MODEL)
+        system_tokens = context_budget.count_tokens(QA_SYSTEM_PROMPT, QA_MODEL)
+        prompt_tokens = system_tokens + history_tokens + context_tokens + query_tokens
+        metrics.observe("chat.prompt_tokens", prompt_tokens)
+        metrics.observe("chat.context_tokens", context_tokens)
+        metrics.observe("chat.history_tokens", history_tokens)
+        pipeline.set("prompt_tokens", prompt_tokens)
+        pipeline.set("context_chunks", len(docs))
+        logger.info(
+            "Prompt tokens: %d (system %d, history %d, context %d from %d chunks, question %d)",
+            prompt_tokens, system_tokens, history_tokens, context_tokens, len(docs), query_tokens,
+        )
 
-    # Update history
-    history.add_user_message(query)
-    history.add_ai_message(response)
+        # Generate response, streaming tokens to the caller as they arrive
+        chunks = []
+        with tracing.span("chat.generate", model=QA_MODEL) as generate:
+            started = time.perf_counter()
+            async for chunk in question_answer_chain.astream({
+                "input": query,
+                "chat_history": recent_history,
+                "context": docs
+            }):
+                if not chunks:
+                    generate.set("first_chunk_seconds", time.perf_counter() - started)
+                chunks.append(chunk)
+                yield chunk
+            response = "".join(chunks)
+            tracing.count("chat.completion_tokens", context_budget.count_tokens(response, QA_MODEL))
+
+        # Update history
+        with tracing.span("chat.save_turn"):
+            await session_store.append_turn(
+                session_id, query, response, summarize=summarize_old_turns if SUMMARIZE_OLD_TURNS else None
+            )
+
+def start_pipeline():
+    """Gets the shared clients and builds this run's retriever and chains; the heavy imports happen here."""
+    global embeddings, index, bm25_encoder, llm, rewrite_llm, query_rewriter, session_store
+    global retriever, contextualize_q_prompt, question_answer_chain
+    import bm25_model
+    from retrievers import AsyncPineconeHybridSearchRetriever
+
+    # Time (and with CHAT_TRACE_MEMORY=1, Python memory) a new session spends getting its clients
+    new_session = "session_started" not in st.session_state
+    if new_session and TRACE_SESSION_MEMORY:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        traced_before, _ = tracemalloc.get_traced_memory()
+    session_init_started = time.perf_counter()
+
+    embeddings = load_embeddings()
+    index = load_index()
+    # Fitted on our loan documents (see bm25_model.py) and shared by every session in the process
+    bm25_encoder = bm25_model.load_encoder()
+    llm = load_llm()
+    rewrite_llm = load_rewrite_llm()
+    query_rewriter = load_query_rewriter()
+    session_store = get_session_store()
+
+    if new_session:
+        st.session_state.session_started = True
+        metrics.observe("chat.session_init_seconds", time.perf_counter() - session_init_started)
+        if TRACE_SESSION_MEMORY:
+            traced_after, _ = tracemalloc.get_traced_memory()
+            metrics.observe("chat.session_init_bytes", traced_after - traced_before)
+            logger.info("New chat session allocated %d bytes getting its clients", traced_after - traced_before)
+
+    # Fetch a few more chunks than fit in the prompt; the context budget picks among them
+    retriever = AsyncPineconeHybridSearchRetriever(
+        embeddings=embeddings, sparse_encoder=bm25_encoder, index=index, cache=load_retrieval_cache(),
+        top_k=int(os.getenv("CHAT_RETRIEVAL_TOP_K", "6")),
+    )
+    contextualize_q_prompt, qa_prompt = build_prompts()
+    question_answer_chain = build_question_answer_chain(llm, qa_prompt)
 
-    return response
 
 # Initialize chat history in session state
 if 'chat_history' not in st.session_state:
     st.session_state['chat_history'] = []
+# Key for this session's history in the session store; fixed once so tools that
+# drive the page (such as benchmark.py) can give each simulated user their own
+chat_session_id = st.session_state.setdefault("chat_session_id", get_script_run_ctx().session_id)
 
 
 # Function to add messages to the chat history
@@ -249,38 +444,45 @@ def add_message(role, message):
     st.session_state['chat_history'].append({"role": role, "content": message})
 
 
-# Display chat history
-chat_container = st.empty()
+# Only the latest messages are rendered; older ones load a page at a time on request
+HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "20"))
+# Redraw the streaming reply at most this often; each redraw resends the whole bubble
+STREAM_REDRAW_SECONDS = 0.1
 
+if "history_shown" not in st.session_state:
+    st.session_state.history_shown = HISTORY_PAGE_SIZE
 
-def display_chat():
-    with chat_container.container():
-        st.markdown('<div class="chat-container">', unsafe_allow_html=True)  # Start the scrollable area
-        for entry in st.session_state['chat_history']:  # Display messages in chronological order
-            role = entry["role"]
-            content = entry["content"]
-
-            if role == "user":
-                st.markdown(
-                    f"""
+
+def message_html(role, content):
+    if role == "user":
+        return f"""
                     <div class="user-message">
                         <div class="message-bubble user-bubble">{content}</div>
-                        <img src="data:image/png;base64,{user_avatar_base64}" class="avatar" alt="User Avatar">
+                        <div class="avatar user-avatar" role="img" aria-label="User Avatar"></div>
                     </div>
-                    """,
-                    unsafe_allow_html=True
-                )
-            else:
-                st.markdown(
-                    f"""
+                    """
+    return f"""
                     <div class="assistant-message">
-                        <img src="data:image/png;base64,{assistant_avatar_base64}" class="avatar" alt="Assistant Avatar">
+                        <div class="avatar assistant-avatar" role="img" aria-label="Assistant Avatar"></div>
                         <div class="message-bubble assistant-bubble">{content}</div>
                     </div>
-                    """,
-                    unsafe_allow_html=True
-                )
-        st.markdown('</div>', unsafe_allow_html=True)  # End the scrollable area
+                    """
+
+
+def display_chat():
+    history = st.session_state['chat_history']
+    hidden = len(history) - st.session_state.history_shown
+    if hidden > 0 and st.button(f"Show earlier messages ({hidden})"):
+        st.session_state.history_shown += HISTORY_PAGE_SIZE
+        hidden -= HISTORY_PAGE_SIZE
+    shown = history[max(hidden, 0):]
+    # One element for the whole visible history, inside the scrollable area
+    st.markdown(
+        '<div class="chat-container">'
+        + "".join(message_html(entry["role"], entry["content"]) for entry in shown)
+        + '</div>',
+        unsafe_allow_html=True,
+    )
 
 
 # Display chat initially
@@ -288,16 +490,40 @@ display_chat()
 
 # User input with st.chat_input
 if user_input := st.chat_input("Type your message here..."):
-    # Add user's message
+    # Add user's message, appending its bubble below the history already on the page
     add_message("user", user_input)
-
-    # Re-display chat with the new message
-    display_chat()
-
-    # Simulate assistant response with a delay
-    with st.spinner("Assistant is typing..."):
-        assistant_reply = asyncio.run(process_query(user_input))
-        add_message("assistant", assistant_reply)
-
-    # Re-display chat with the assistant's response
-    display_chat()
\ No newline at end of file
+    st.markdown(message_html("user", user_input), unsafe_allow_html=True)
+
+    # Stream the assistant's reply into its bubble as tokens arrive
+    reply_placeholder = st.empty()
+    reply_placeholder.markdown(message_html("assistant", "<i>GAB is typing...</i>"), unsafe_allow_html=True)
+    start_pipeline()
+    import openai
+    streamed = []
+    started = time.perf_counter()
+    last_redraw = 0.0
+
+    # The pipeline runs on the process-wide event loop; chunks are rendered here on the script thread
+    try:
+        for chunk in async_runtime.iterate(process_query(user_input, chat_session_id)):
+            if not streamed:
+                time_to_first_token = time.perf_counter() - started
+                metrics.observe("chat.time_to_first_token_seconds", time_to_first_token)
+                logger.info("Time to first token: %.3fs", time_to_first_token)
+            streamed.append(chunk)
+            if time.perf_counter() - last_redraw >= STREAM_REDRAW_SECONDS:
+                reply_placeholder.markdown(message_html("assistant", "".join(streamed) + " ▌"), unsafe_allow_html=True)
+                last_redraw = time.perf_counter()
+    except openai.APIConnectionError:
+        # Drop the shared client so the next message starts on fresh connections
+        logger.warning("Lost the connection to OpenAI; the chat model will reconnect", exc_info=True)
+        load_llm.clear()
+        reply_placeholder.error("GAB couldn't be reached. Please send your message again.")
+        st.stop()
+
+    assistant_reply = "".join(streamed)
+    metrics.observe("chat.turn_seconds", time.perf_counter() - started)
+    add_message("assistant", assistant_reply)
+
+    # Finish the reply bubble in place; the next rerun folds both bubbles into the history
+    reply_placeholder.markdown(message_html("assistant", assistant_reply), unsafe_allow_html=True)
\ No newline at end of file
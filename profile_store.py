@@ -0,0 +1,175 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryProfileStore:
+    """Keeps each session's extracted profile in process memory, keyed by session ID.
+
+    Profiles unused for `ttl_seconds` expire, and past `max_sessions` the least
+    recently used one is evicted, so closed tabs don't leave their PII behind.
+    """
+
+    def __init__(self, ttl_seconds=3600, max_sessions=1000):
+        self.ttl = ttl_seconds
+        self.max_sessions = max_sessions
+        self._profiles = OrderedDict()
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Returns a copy of the session's profile, or an empty dict for a new session."""
+        with self._lock:
+            return dict(self._touch(session_id))
+
+    def update(self, session_id, fields):
+        """Merges fields into the session's profile."""
+        with self._lock:
+            self._touch(session_id).update(fields)
+            self._mark_dirty(session_id)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._profiles.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+
+    def flush(self):
+        pass
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def _touch(self, session_id):
+        now = time.time()
+        self._expire(now)
+        profile = self._profiles.get(session_id)
+        if profile is None:
+            profile = self._load(session_id)
+            self._profiles[session_id] = profile
+            while len(self._profiles) > self.max_sessions:
+                self._evict(*self._profiles.popitem(last=False))
+        self._profiles.move_to_end(session_id)
+        self._last_used[session_id] = now
+        return profile
+
+    def _expire(self, now):
+        while self._profiles:
+            session_id, profile = next(iter(self._profiles.items()))
+            if now - self._last_used[session_id] < self.ttl:
+                break
+            del self._profiles[session_id]
+            self._evict(session_id, profile)
+
+    def _evict(self, session_id, profile):
+        self._last_used.pop(session_id, None)
+
+    def _load(self, session_id):
+        return {}
+
+    def _mark_dirty(self, session_id):
+        pass
+
+
+class SQLiteProfileStore(MemoryProfileStore):
+    """Memory-first profile store with write-behind persistence to SQLite.
+
+    Reads are served from memory and only fall through to SQLite the first time a
+    session is seen by this process. Updates are applied in memory and the dirty
+    sessions are written in a single transaction every `flush_interval` seconds
+    (and on exit), so a full set of uploads costs one commit rather than one per document.
+    Each flush also deletes profiles not updated for `ttl_seconds`.
+    """
+
+    def __init__(self, path, flush_interval=1.0, **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS profiles (session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._dirty = set()
+        # Dirty profiles evicted from memory before their flush
+        self._unwritten = {}
+        self._flush_interval = flush_interval
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name="profile-store-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def discard(self, session_id):
+        super().discard(session_id)
+        with self._lock:
+            self._dirty.discard(session_id)
+            self._unwritten.pop(session_id, None)
+        with self._db_lock:
+            self._db.execute("DELETE FROM profiles WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def flush(self):
+        now = time.time()
+        with self._lock:
+            rows = [
+                (session_id, json.dumps(self._profiles[session_id]), now)
+                for session_id in self._dirty if session_id in self._profiles
+            ]
+            rows += [(session_id, json.dumps(profile), now) for session_id, profile in self._unwritten.items()]
+            self._dirty.clear()
+            self._unwritten.clear()
+        with self._db_lock:
+            with self._db:
+                if rows:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO profiles (session_id, data, updated_at) VALUES (?, ?, ?)", rows
+                    )
+                self._db.execute("DELETE FROM profiles WHERE updated_at <= ?", (now - self.ttl,))
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+
+    def _load(self, session_id):
+        if session_id in self._unwritten:
+            return self._unwritten.pop(session_id)
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT data FROM profiles WHERE session_id = ? AND updated_at > ?", (session_id, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _evict(self, session_id, profile):
+        super()._evict(session_id, profile)
+        if session_id in self._dirty:
+            self._dirty.discard(session_id)
+            self._unwritten[session_id] = profile
+
+    def _mark_dirty(self, session_id):
+        self._dirty.add(session_id)
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self._flush_interval):
+            self.flush()
+
+
+def create_profile_store():
+    """Builds the store selected by PROFILE_STORE ('memory' or 'sqlite')."""
+    backend = os.getenv("PROFILE_STORE", "memory")
+    options = {
+        "ttl_seconds": float(os.getenv("PROFILE_TTL_SECONDS", "3600")),
+        "max_sessions": int(os.getenv("PROFILE_MAX_SESSIONS", "1000")),
+    }
+    if backend == "sqlite":
+        return SQLiteProfileStore(
+            os.getenv("PROFILE_STORE_PATH", ".cache/profiles.sqlite3"),
+            flush_interval=float(os.getenv("PROFILE_STORE_FLUSH_SECONDS", "1.0")),
+            **options,
+        )
+    if backend == "memory":
+        return MemoryProfileStore(**options)
+    raise ValueError(f"Unknown PROFILE_STORE backend: {backend}")
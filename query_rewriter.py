@@ -0,0 +1,104 @@
+"""Decides when a follow-up question needs rewriting before retrieval, and caches rewrites.
+
+Rewriting a question into a standalone one costs an LLM call before retrieval
+can start. Most questions don't need it: only those that lean on the
+conversation do, such as ones with pronouns ("magkano yun?"), short follow-ups
+("what about SME Loan?"), and answers to a question GAB just asked ("3 years na po").
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import metrics
+import tracing
+
+REFERRING_WORDS = {
+    # English
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "one", "ones", "same", "above",
+    "former", "latter", "there",
+    # Tagalog / Taglish
+    "ito", "iyan", "iyon", "yan", "yun", "yon", "yung", "niyan", "niyon", "nito", "diyan", "dyan", "doon",
+    "dun", "jan", "siya", "sila", "nila", "niya", "ganun", "ganyan", "ganoon", "parehas", "pareho",
+}
+FOLLOW_UP_OPENERS = (
+    "and ", "also ", "what about", "how about", "what if", "then ", "so ", "eh ", "e ", "paano naman",
+    "pano naman", "paano kung", "pano kung", "saka ", "tsaka ", "at ", "kung ganun", "edi ", "e di ",
+)
+# Questions with at most this many words are read as follow-ups
+SHORT_FOLLOW_UP_WORDS = 4
+HISTORY_TAIL_MESSAGES = 2
+
+
+def needs_rewrite(query, chat_history):
+    """Cheap check for whether the question depends on earlier turns."""
+    if not chat_history:
+        return False
+    text = unicodedata.normalize("NFKC", query).casefold().strip()
+    words = re.findall(r"\w+", text)
+    if len(words) <= SHORT_FOLLOW_UP_WORDS:
+        return True
+    if text.startswith(FOLLOW_UP_OPENERS):
+        return True
+    if REFERRING_WORDS.intersection(words):
+        return True
+    # GAB asks the MSME assessment questions; a reply to one only makes sense alongside it
+    last_message = chat_history[-1]
+    return last_message.type == "ai" and last_message.content.rstrip().endswith("?")
+
+
+class QueryRewriter:
+    """LRU cache of rewrites keyed on the recent history and the question, with rewrite metrics."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._rewrites = OrderedDict()
+        self._lock = threading.Lock()
+
+    def needed(self, query, chat_history):
+        """needs_rewrite, counting the turns that skip rewriting."""
+        if needs_rewrite(query, chat_history):
+            return True
+        metrics.increment("chat.rewrites_skipped")
+        return False
+
+    async def rewrite(self, query, chat_history, contextualize):
+        """Standalone form of query; `contextualize(query, chat_history)` is the async LLM call used on a miss."""
+        key = self.key(query, chat_history)
+        with self._lock:
+            rewritten = self._rewrites.get(key)
+            if rewritten is not None:
+                self._rewrites.move_to_end(key)
+        if rewritten is not None:
+            metrics.increment("chat.rewrite_cache_hits")
+            return rewritten
+
+        # The span records chat.rewrite_seconds
+        with tracing.span("chat.rewrite"):
+            rewritten = (await contextualize(query, chat_history)).strip() or query
+        metrics.increment("chat.rewrites")
+        with self._lock:
+            self._rewrites[key] = rewritten
+            while len(self._rewrites) > self.max_entries:
+                self._rewrites.popitem(last=False)
+        return rewritten
+
+    @staticmethod
+    def key(query, chat_history):
+        tail = chat_history[-HISTORY_TAIL_MESSAGES:]
+        payload = "\x1e".join([*(f"{message.type}:{message.content}" for message in tail), query.strip()])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def stats(self):
+        rewrites = metrics.counter("chat.rewrites")
+        skipped = metrics.counter("chat.rewrites_skipped")
+        cache_hits = metrics.counter("chat.rewrite_cache_hits")
+        turns = rewrites + skipped + cache_hits
+        return {
+            "rewrites": rewrites,
+            "skipped": skipped,
+            "cache_hits": cache_hits,
+            "rewrite_rate": rewrites / turns if turns else 0.0,
+            "rewrite_seconds": metrics.distribution_stats("chat.rewrite_seconds"),
+        }
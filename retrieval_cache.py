@@ -0,0 +1,189 @@
+"""Retrieval cache for the chatbot that also matches reworded questions.
+
+Lookups go in two steps. The normalized question text is checked first, which
+costs nothing. If that misses, the query embedding (already computed for the
+hybrid search) is compared against cached embeddings, and a close enough match
+is served without querying the index. Entries expire after a TTL and are tied
+to a knowledge-base version, so re-indexing invalidates them. With a SQLite path,
+several Streamlit workers share each other's results.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from langchain_core.documents import Document
+
+import metrics
+
+# Politeness particles that don't change what a Taglish question is asking
+FILLER_WORDS = {"po", "ho", "opo", "oho"}
+
+
+def normalize_query(text):
+    text = unicodedata.normalize("NFKC", text).casefold()
+    words = re.sub(r"[^\w\s]", " ", text).split()
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+class RetrievalCache:
+    def __init__(self, index_version="", ttl_seconds=3600, max_entries=2000, similarity_threshold=0.95,
+                 path=None, sync_interval=5.0):
+        self.index_version = index_version
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._entries = [None] * max_entries  # (key, created_at, documents) per slot
+        self._vectors = None
+        self._created_at = np.full(max_entries, -np.inf)  # per slot, so expired slots can be masked in one go
+        self._next_slot = 0
+        self._miss_seconds = 0.0
+        self._misses_timed = 0
+        self._db = None
+        self._last_sync = 0.0
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS retrievals (key TEXT NOT NULL, index_version TEXT NOT NULL, "
+                "created_at REAL NOT NULL, embedding BLOB NOT NULL, documents TEXT NOT NULL, "
+                "PRIMARY KEY (key, index_version))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS retrievals_created_at ON retrievals (created_at)")
+            self._db.commit()
+
+    def get_by_text(self, query):
+        """Documents cached for the same normalized question, or None."""
+        key = normalize_query(query)
+        with self._lock:
+            self._sync_from_disk()
+            slot = self._keys.get(key)
+            documents = self._live_documents(slot)
+        if documents is None:
+            return None
+        self._record_hit("exact")
+        return documents
+
+    def get_by_embedding(self, embedding):
+        """Documents cached for the most similar earlier question, if it is similar enough."""
+        query_vector = _unit_vector(embedding)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != query_vector.shape[0]:
+                documents = None
+            else:
+                scores = self._vectors @ query_vector
+                # Expired and empty slots can't win the argmax over a live match
+                scores[time.time() - self._created_at >= self.ttl] = -np.inf
+                slot = int(np.argmax(scores))
+                documents = self._live_documents(slot) if scores[slot] >= self.similarity_threshold else None
+        if documents is None:
+            metrics.increment("retrieval_cache.misses")
+            return None
+        self._record_hit("semantic")
+        return documents
+
+    def put(self, query, embedding, documents, elapsed_seconds=None):
+        """Caches the documents retrieved for a question; elapsed_seconds is what the miss cost."""
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            if elapsed_seconds is not None:
+                self._miss_seconds += elapsed_seconds
+                self._misses_timed += 1
+            self._remember(key, now, _unit_vector(embedding), documents)
+        if self._db is not None:
+            payload = json.dumps([{"page_content": d.page_content, "metadata": d.metadata} for d in documents])
+            vector = np.asarray(embedding, dtype=np.float32).tobytes()
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO retrievals VALUES (?, ?, ?, ?, ?)",
+                    (key, self.index_version, now, vector, payload),
+                )
+                self._db.execute("DELETE FROM retrievals WHERE created_at <= ?", (now - self.ttl,))
+                self._db.commit()
+
+    def set_index_version(self, index_version):
+        """Drops every entry when the knowledge base changes."""
+        with self._lock:
+            if index_version == self.index_version:
+                return
+            self.index_version = index_version
+            self._keys.clear()
+            self._entries = [None] * self.max_entries
+            self._vectors = None
+            self._created_at.fill(-np.inf)
+            self._next_slot = 0
+            self._last_sync = 0.0
+
+    def stats(self):
+        exact = metrics.counter("retrieval_cache.exact_hits")
+        semantic = metrics.counter("retrieval_cache.semantic_hits")
+        misses = metrics.counter("retrieval_cache.misses")
+        lookups = exact + semantic + misses
+        return {
+            "exact_hits": exact,
+            "semantic_hits": semantic,
+            "misses": misses,
+            "hit_rate": (exact + semantic) / lookups if lookups else 0.0,
+            "saved_seconds": metrics.counter("retrieval_cache.saved_seconds"),
+            "entries": len(self._keys),
+        }
+
+    def _record_hit(self, kind):
+        metrics.increment(f"retrieval_cache.{kind}_hits")
+        with self._lock:
+            average_miss = self._miss_seconds / self._misses_timed if self._misses_timed else 0.0
+        # Each hit saves roughly what an average miss costs
+        metrics.increment("retrieval_cache.saved_seconds", average_miss)
+
+    def _live_documents(self, slot):
+        if slot is None or self._entries[slot] is None:
+            return None
+        _, created_at, documents = self._entries[slot]
+        if time.time() - created_at >= self.ttl:
+            return None
+        return list(documents)
+
+    def _remember(self, key, created_at, vector, documents):
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+        slot = self._keys.get(key)
+        if slot is None:
+            # Ring buffer: the oldest entry gives up its slot
+            slot = self._next_slot
+            self._next_slot = (self._next_slot + 1) % self.max_entries
+            evicted = self._entries[slot]
+            if evicted is not None:
+                self._keys.pop(evicted[0], None)
+            self._keys[key] = slot
+        self._entries[slot] = (key, created_at, tuple(documents))
+        self._vectors[slot] = vector
+        self._created_at[slot] = created_at
+
+    def _sync_from_disk(self):
+        """Pulls entries other workers cached since the last sync."""
+        if self._db is None or time.time() - self._last_sync < self.sync_interval:
+            return
+        since = max(self._last_sync - self.sync_interval, time.time() - self.ttl)
+        self._last_sync = time.time()
+        rows = self._db.execute(
+            "SELECT key, created_at, embedding, documents FROM retrievals WHERE index_version = ? AND created_at > ?",
+            (self.index_version, since),
+        ).fetchall()
+        for key, created_at, embedding, payload in rows:
+            documents = [Document(**document) for document in json.loads(payload)]
+            self._remember(key, created_at, _unit_vector(np.frombuffer(embedding, dtype=np.float32)), documents)
+
+
+def _unit_vector(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
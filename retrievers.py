@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import time
+from typing import Any, List, Optional
+
+from langchain_community.retrievers import PineconeHybridSearchRetriever
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+
+import tracing
+from local_search import LocalHybridIndex
+
+
+class AsyncPineconeHybridSearchRetriever(PineconeHybridSearchRetriever):
+    """PineconeHybridSearchRetriever with a native async path.
+
+    The stock retriever's async method runs the whole sync search in an executor,
+    so the query is BM25-encoded and then embedded one after the other. Here the
+    dense embedding (a network call) and the sparse encoding (CPU) run concurrently,
+    and only the blocking Pinecone query is pushed to a worker thread. `index` may
+    also be a local_search.LocalHybridIndex, which is queried inline.
+
+    With a `cache` (see retrieval_cache.RetrievalCache), repeated and reworded
+    questions are answered from it instead of querying the index.
+    """
+
+    cache: Optional[Any] = None
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, **kwargs: Any
+    ) -> List[Document]:
+        from pinecone_text.hybrid import hybrid_convex_scale
+
+        if self.cache is not None:
+            cached = self.cache.get_by_text(query)
+            if cached is not None:
+                return cached
+
+        started = time.perf_counter()
+        with tracing.span("retrieval.encode"):
+            dense_vec, sparse_vec = await asyncio.gather(
+                self.embeddings.aembed_query(query),
+                asyncio.to_thread(self.sparse_encoder.encode_queries, query),
+            )
+        if self.cache is not None:
+            cached = self.cache.get_by_embedding(dense_vec)
+            if cached is not None:
+                return cached
+        query_vec = dense_vec
+        dense_vec, sparse_vec = hybrid_convex_scale(dense_vec, sparse_vec, self.alpha)
+        sparse_vec["values"] = [float(value) for value in sparse_vec["values"]]
+        search = functools.partial(
+            self.index.query,
+            vector=dense_vec,
+            sparse_vector=sparse_vec,
+            top_k=self.top_k,
+            include_metadata=True,
+            namespace=self.namespace,
+            **kwargs,
+        )
+        # The in-process index answers in well under a millisecond; a thread hop would cost more
+        is_local = isinstance(self.index, LocalHybridIndex)
+        with tracing.span("retrieval.index_query", backend="local" if is_local else "pinecone", top_k=self.top_k):
+            result = search() if is_local else await asyncio.to_thread(search)
+        documents = matches_to_documents(result["matches"], self.text_key)
+        if self.cache is not None:
+            self.cache.put(query, query_vec, documents, time.perf_counter() - started)
+        return documents
+
+
+def matches_to_documents(matches, text_key):
+    documents = []
+    for match in matches:
+        metadata = dict(match["metadata"])
+        context = metadata.pop(text_key)
+        if "score" not in metadata and "score" in match:
+            metadata["score"] = match["score"]
+        documents.append(Document(page_content=context, metadata=metadata))
+    return documents
@@ -0,0 +1,85 @@
+"""Import-time profile of a page's first run, to catch startup regressions.
+
+Runs the page once with Streamlit's AppTest in a fresh interpreter under
+`python -X importtime` and reports only the imports made while the page ran
+(Streamlit's own are excluded):
+
+    python startup_profile.py                              # pages/chatbot.py
+    python startup_profile.py main.py --top 30
+    python startup_profile.py --max-seconds 0.5            # exit 1 if the page imports take longer
+    python startup_profile.py --raw > importtime.txt       # the raw -X importtime lines
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+START_MARKER = "--- page run starts ---"
+END_MARKER = "--- page run ends ---"
+
+RUNNER = f"""
+import sys
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=120)
+print({START_MARKER!r}, file=sys.stderr, flush=True)
+app.run()
+print({END_MARKER!r}, file=sys.stderr, flush=True)
+if app.exception:
+    print(app.exception, file=sys.stdout)
+"""
+
+
+def profile_page(page):
+    """Returns (module, self_us, cumulative_us, depth) for each import made while the page ran, plus raw lines."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", RUNNER, page],
+        cwd=ROOT, capture_output=True, text=True, check=False,
+    )
+    if completed.stdout.strip():
+        print(completed.stdout.strip(), file=sys.stderr)
+    lines = completed.stderr.splitlines()
+    try:
+        lines = lines[lines.index(START_MARKER) + 1:lines.index(END_MARKER)]
+    except ValueError:
+        raise SystemExit(f"The page run did not complete:\n{completed.stderr[-2000:]}")
+
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue  # the column header
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        imports.append((stripped, int(self_us), int(cumulative_us), depth))
+    return imports, lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("page", nargs="?", default=os.path.join("pages", "chatbot.py"))
+    parser.add_argument("--top", type=int, default=15, help="slowest top-level imports to list")
+    parser.add_argument("--max-seconds", type=float, help="fail if the page's imports take longer than this")
+    parser.add_argument("--raw", action="store_true", help="print the raw -X importtime lines instead")
+    args = parser.parse_args(argv)
+
+    imports, lines = profile_page(args.page)
+    if args.raw:
+        print("\n".join(lines))
+        return 0
+
+    total_seconds = sum(self_us for _, self_us, _, _ in imports) / 1e6
+    top_level = sorted((entry for entry in imports if entry[3] == 0), key=lambda entry: entry[2], reverse=True)
+    print("%s: %d modules imported in %.3fs" % (args.page, len(imports), total_seconds))
+    for name, _, cumulative_us, _ in top_level[:args.top]:
+        print("  %8.1f ms  %s" % (cumulative_us / 1000, name))
+    if args.max_seconds is not None and total_seconds > args.max_seconds:
+        print("Import time %.3fs is over the %.3fs limit" % (total_seconds, args.max_seconds), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
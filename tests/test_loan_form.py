@@ -0,0 +1,46 @@
+import os
+import sys
+from decimal import Decimal
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ["PROFILE_STORE"] = "memory"
+
+import profile_store  # noqa: E402
+
+
+def loan_form_app(monkeypatch, profile):
+    monkeypatch.setattr(profile_store.MemoryProfileStore, "get", lambda self, session_id: dict(profile))
+    app = AppTest.from_file(str(ROOT / "main.py"), default_timeout=60)
+    app.session_state["home"] = False
+    app.session_state["show_loan_application_form"] = True
+    return app
+
+
+def text_input(app, key):
+    return next(widget for widget in app.text_input if widget.key == key)
+
+
+def test_prefill_accepts_decimal_amounts(monkeypatch):
+    app = loan_form_app(monkeypatch, {"First Name": "Juan", "Last Name": "Cruz", "Total Revenue": Decimal("1250000.00")})
+    app.run()
+    assert not app.exception
+    assert text_input(app, "loan_form_full_name").value == "Juan Cruz"
+    assert text_input(app, "loan_form_annual_sales_revenue").value == "1250000.00"
+
+
+def test_new_extraction_replaces_prefill(monkeypatch):
+    profile = {"First Name": "Juan", "Last Name": "Cruz"}
+    app = loan_form_app(monkeypatch, profile)
+    app.run()
+    text_input(app, "loan_form_full_name").set_value("Typed").run()
+    assert text_input(app, "loan_form_full_name").value == "Typed"
+
+    profile["First Name"] = "Maria"
+    del app.session_state["loan_form_defaults"]
+    app.run()
+    assert text_input(app, "loan_form_full_name").value == "Maria Cruz"
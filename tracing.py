@@ -0,0 +1,254 @@
+"""Spans and stage timers for the extraction and chat pipelines, with Prometheus and OTLP/JSON export.
+
+    with tracing.span("extraction.vision_call", document_type=document_type):
+        ...
+        tracing.count("openai.prompt_tokens", response.usage.prompt_tokens)
+
+Every span's duration is observed in metrics as "<name>_seconds", so per-stage
+percentiles are always available. Full traces (the span tree with attributes and
+counts) are only kept for a sampled share of root spans, TRACE_SAMPLE_RATE
+(default 1; 0.01 or so in production), and an unsampled span costs two clock
+reads and a metrics observation. Spans started on another thread or task nest
+under the span that was current when it was started, as long as the contextvars
+context is carried over (asyncio tasks and asyncio.to_thread do this; see
+extraction.extract_documents for a thread pool).
+
+Finished spans are kept in memory (the last TRACE_BUFFER_SPANS) and, with
+TRACE_EXPORT_PATH set, each finished trace is appended to that file as one
+OTLP/JSON line, the format the OpenTelemetry Collector's otlpjsonfile receiver
+reads. With METRICS_PORT set, start_metrics_server() serves /metrics in the
+Prometheus text format and /traces as OTLP/JSON.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1"))
+EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH") or None
+BUFFER_SPANS = int(os.getenv("TRACE_BUFFER_SPANS", "2000"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "ka-negosyo-assistant")
+
+_current = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_finished = deque(maxlen=BUFFER_SPANS)
+# Finished spans of sampled traces whose root span is still open, keyed by trace ID
+_open_traces = {}
+MAX_OPEN_TRACES = 1000
+_server = None
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.sampled = parent.sampled if parent is not None else random.random() < SAMPLE_RATE
+        if self.sampled:
+            self.span_id = secrets.token_hex(8)
+            if parent is not None:
+                self.trace_id = parent.trace_id
+            else:
+                self.trace_id = secrets.token_hex(16)
+                with _lock:
+                    _open_traces[self.trace_id] = []
+                    # Roots that never finish (an abandoned generator, say) mustn't pile up
+                    while len(_open_traces) > MAX_OPEN_TRACES:
+                        del _open_traces[next(iter(_open_traces))]
+        else:
+            self.trace_id = self.span_id = None
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, key, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def add(self, key, amount):
+        if self.sampled:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+
+@contextmanager
+def span(name, **attributes):
+    """Times the block as stage `name`; yields the Span so attributes can be set on it."""
+    parent = _current.get()
+    current = Span(name, parent, attributes)
+    token = _current.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception as error:
+        current.error = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        metrics.observe(f"{name}_seconds", time.perf_counter() - started)
+        _current.reset(token)
+        if current.sampled:
+            current.end_ns = time.time_ns()
+            _finish(current, is_root=parent is None)
+
+
+def count(name, amount=1):
+    """Adds to counter `name` and to the same-named attribute of the current span."""
+    metrics.increment(name, amount)
+    current = _current.get()
+    if current is not None:
+        current.add(name, amount)
+
+
+def current_span():
+    return _current.get()
+
+
+def _finish(finished, is_root):
+    with _lock:
+        _finished.append(finished)
+        trace = _open_traces.get(finished.trace_id)
+        if trace is None:
+            # Outlived its root (a speculative search nobody waited for); exported on its own
+            trace = [finished]
+        else:
+            trace.append(finished)
+            if not is_root:
+                return
+            del _open_traces[finished.trace_id]
+    if EXPORT_PATH:
+        try:
+            with open(EXPORT_PATH, "a", encoding="utf-8") as file:
+                file.write(json.dumps(otlp_json(trace)) + "\n")
+        except OSError:
+            logger.warning("Couldn't write trace to %s", EXPORT_PATH, exc_info=True)
+
+
+def recent_spans():
+    with _lock:
+        return list(_finished)
+
+
+def otlp_json(spans):
+    """Spans as an OTLP/JSON ExportTraceServiceRequest."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{
+            "scope": {"name": __name__},
+            "spans": [_otlp_span(finished) for finished in spans],
+        }],
+    }]}
+
+
+def _otlp_span(finished):
+    payload = {
+        "traceId": finished.trace_id,
+        "spanId": finished.span_id,
+        "name": finished.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(finished.start_ns),
+        "endTimeUnixNano": str(finished.end_ns),
+        "attributes": [_attribute(key, value) for key, value in finished.attributes.items()],
+        "status": {"code": 2, "message": finished.error} if finished.error else {"code": 1},
+    }
+    if finished.parent_id:
+        payload["parentSpanId"] = finished.parent_id
+    return payload
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def prometheus_text():
+    """Counters, gauges and distributions from metrics in the Prometheus text exposition format."""
+    snapshot = metrics.snapshot()
+    lines = []
+    typed = set()
+
+    def declare(metric, kind):
+        # One TYPE line per metric family, however many label sets it has
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} {kind}")
+
+    for kind, values in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+        for name, value in sorted(values.items()):
+            metric, labels = _metric_name(name)
+            declare(metric, kind)
+            lines.append(f"{metric}{_labels(labels)} {value}")
+    for name, stats in sorted(snapshot["distributions"].items()):
+        metric, labels = _metric_name(name)
+        declare(metric, "summary")
+        # Quantiles cover the last metrics.WINDOW observations; count and sum cover the process lifetime
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+            if stats[key] is not None:
+                quantile_label = f'quantile="{quantile}"'
+                lines.append(f"{metric}{_labels(labels, quantile_label)} {stats[key]}")
+        lines += [f"{metric}_count{_labels(labels)} {stats['total']}", f"{metric}_sum{_labels(labels)} {stats['sum']}"]
+    return "\n".join(lines) + "\n"
+
+
+def _metric_name(name):
+    """Splits a metrics key into a Prometheus metric name and its label pairs."""
+    base, _, labels = name.partition("{")
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", base), labels.rstrip("}")
+
+
+def _labels(*pairs):
+    pairs = [pair for pair in pairs if pair]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            self._send(prometheus_text().encode("utf-8"), "text/plain; version=0.0.4")
+        elif path == "/traces":
+            self._send(json.dumps(otlp_json(recent_spans())).encode("utf-8"), "application/json")
+        else:
+            self.send_error(404)
+
+    def _send(self, data, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(port=None):
+    """Serves /metrics and /traces on METRICS_PORT (once per process); does nothing if it isn't set."""
+    global _server
+    port = port if port is not None else os.getenv("METRICS_PORT")
+    if port is None or port == "":
+        return None
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((os.getenv("METRICS_HOST", "127.0.0.1"), int(port)), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            logger.info("Serving metrics on port %d", _server.server_port)
+        return _server